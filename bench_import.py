@@ -0,0 +1,64 @@
+import argparse
+import statistics
+import subprocess
+import sys
+
+# Measures the import time of the simulation core in fresh interpreters.
+# The server, benchmarks and headless runners only import these modules,
+# so pygame must never show up and startup has to stay within the budget.
+#
+#   python3 bench_import.py                # game core, default budget
+#   python3 bench_import.py --budget-ms 30 --runs 20
+
+CORE_MODULES = ['settings', 'game']
+FORBIDDEN_MODULES = ['pygame', 'render']
+
+PROBE = '''
+import sys, time
+start = time.perf_counter()
+import {module}
+elapsed = time.perf_counter() - start
+leaked = [m for m in {forbidden!r} if m in sys.modules]
+print(elapsed * 1000, ','.join(leaked))
+'''
+
+
+def measure(module, runs):
+    timings = []
+    leaked = set()
+    for _ in range(runs):
+        result = subprocess.run(
+            [sys.executable, '-c', PROBE.format(module=module, forbidden=FORBIDDEN_MODULES)],
+            capture_output=True, text=True, check=True
+        )
+        elapsed, _, names = result.stdout.strip().partition(' ')
+        timings.append(float(elapsed))
+        leaked.update(name for name in names.split(',') if name)
+    return timings, leaked
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Import time budget for the simulation core')
+    parser.add_argument('--budget-ms', type=float, default=50.0, help='median import budget per module')
+    parser.add_argument('--runs', type=int, default=10)
+    parser.add_argument('modules', nargs='*', default=CORE_MODULES)
+    args = parser.parse_args()
+
+    failed = False
+    for module in args.modules:
+        timings, leaked = measure(module, args.runs)
+        median = statistics.median(timings)
+        status = 'ok'
+        if leaked:
+            status = f"FAIL (imports {', '.join(sorted(leaked))})"
+            failed = True
+        elif median > args.budget_ms:
+            status = f'FAIL (over {args.budget_ms:.0f} ms budget)'
+            failed = True
+        print(f'{module:<10} median {median:6.1f} ms  max {max(timings):6.1f} ms  {status}')
+
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,224 @@
+import os
+os.environ.setdefault('SDL_VIDEODRIVER', 'dummy')  # Headless: no window, no display needed
+os.environ.setdefault('SDL_AUDIODRIVER', 'dummy')
+
+import argparse
+import json
+import random
+import statistics
+import sys
+import time
+from types import SimpleNamespace
+
+import pygame
+
+import render
+from client_state import GameState
+from game import GameMap, generate_map
+from interest import InterestGrid
+from settings import TILE_SIZE, HUD_HEIGHT, MAX_PLAYERS
+
+# Headless rendering benchmark for the client draw functions.
+#
+# Renders synthetic game states (or states recorded with `client.py --record`)
+# with SDL's dummy video driver and reports frame time percentiles and the time
+# spent in each draw phase. Scenarios marked 'view' are replayed the way a
+# player records them: area-of-interest views encoded by interest.py and
+# decoded again, one JSON line per frame. Exits non-zero when p99 goes over --budget-ms, so it
+# can catch rendering regressions on a headless box.
+#
+#   python3 bench_render.py
+#   python3 bench_render.py --scenario full-board --frames 1000 --budget-ms 8
+#   python3 bench_render.py --recorded match.jsonl
+
+PHASES = ['background', 'tiles', 'bombs', 'explosions', 'players', 'hud']
+
+
+def synthetic_messages(scenario, frames, rng):
+    # Server messages for one scenario, players walk a little every frame
+    width, height = SCENARIOS[scenario]['grid']
+    matrix = GameMap(width=15, height=11).maps[0] if (width, height) == (15, 11) else generate_map(width, height)
+    matrix = [row[:] for row in matrix]
+    free = [(x, y) for y in range(height) for x in range(width) if matrix[y][x] == 0]
+    options = SCENARIOS[scenario]
+
+    if options.get('full_board'):
+        # Every free cell breakable or breaking
+        for (x, y) in free:
+            matrix[y][x] = rng.choice((2, 2, 2, -2))
+    bombs = [
+        {'x': x, 'y': y, 'player_id': rng.randrange(MAX_PLAYERS)}
+        for (x, y) in rng.sample(free, min(options.get('bombs', 0), len(free)))
+    ]
+    explosions = []
+    for (x, y) in rng.sample(free, min(options.get('explosions', 0), len(free))):
+        reach = options.get('explosion_range', 3)
+        sectors = [[x, y]]
+        for dx, dy in ((1, 0), (-1, 0), (0, 1), (0, -1)):
+            for i in range(1, reach + 1):
+                sx, sy = x + i * dx, y + i * dy
+                if not (0 < sx < width - 1 and 0 < sy < height - 1) or matrix[sy][sx] == 1:
+                    break
+                sectors.append([sx, sy])
+        explosions.append({'sectors': sectors, 'bomb_type': 'BOMB_TYPE_1', 'player_id': rng.randrange(MAX_PLAYERS)})
+
+    positions = {str(i): list(position) for i, position in enumerate(rng.sample(free, min(options['players'], len(free))))}
+    lives = [3 if str(i) in positions else 0 for i in range(MAX_PLAYERS)]
+    for frame in range(frames):
+        for position in positions.values():
+            position[frame % 2] += 0.05 if (frame // 20) % 2 == 0 else -0.05
+        yield {
+            'players': {key: [round(x, 3), round(y, 3)] for key, (x, y) in positions.items()},
+            'bombs': bombs,
+            'explosions': explosions,
+            'map': matrix,
+            'lives': lives,
+            'timestamp': frame / 60,
+        }
+
+
+def view_messages(scenario, frames, rng):
+    # The synthetic messages as a player records them: views around player 0, through the JSON encoding
+    grid = InterestGrid(8, 1)
+    room = SimpleNamespace(revision=0, changes=[])
+    known = {}  # Chunks player 0 already has, as the server tracks them
+    for tick, message in enumerate(synthetic_messages(scenario, frames, rng)):
+        room.matrix = message['map']
+        room.height, room.width = len(room.matrix), len(room.matrix[0])
+        grid.update(room, [])
+        players = message['players']
+        grid.begin_tick({
+            'tick': tick, 'revision': room.revision, 'width': room.width, 'height': room.height,
+            'far_players': {key: [round(x), round(y)] for key, (x, y) in players.items()},
+            'lives': message['lives'], 'timestamp': message['timestamp'], 'server_time': message['timestamp'],
+        }, message)
+        x, y = players.get('0', (0, 0))
+        yield json.loads(grid.snapshot(x, y, known))
+
+
+def message_grid(message):
+    # (width, height) of a keyframe or a view
+    if 'map' in message:
+        return len(message['map'][0]), len(message['map'])
+    return message['width'], message['height']
+
+
+def recorded_messages(path, frames):
+    # Replay a recording from `client.py --record`, looping if it is shorter than --frames
+    with open(path) as f:
+        messages = [json.loads(line) for line in f if line.strip()]
+    for frame in range(frames):
+        yield messages[frame % len(messages)]
+
+
+SCENARIOS = {
+    'idle': {'grid': (15, 11), 'players': 2},
+    'typical': {'grid': (15, 11), 'players': 2, 'bombs': 4, 'explosions': 1},
+    'many-bombs': {'grid': (15, 11), 'players': 8, 'bombs': 48},
+    'wide-explosions': {'grid': (15, 11), 'players': 8, 'explosions': 12, 'explosion_range': 14},
+    'full-board': {'grid': (15, 11), 'players': 8, 'bombs': 24, 'explosions': 6, 'full_board': True},
+    'large-grid': {'grid': (31, 21), 'players': 8, 'bombs': 64, 'explosions': 16, 'full_board': True},
+    'large-grid-view': {'grid': (31, 21), 'players': 8, 'bombs': 64, 'explosions': 16, 'full_board': True,
+                        'view': True},
+}
+
+
+def run(messages, grid):
+    width, height = grid
+    screen = pygame.display.set_mode((width * TILE_SIZE, height * TILE_SIZE + HUD_HEIGHT))
+    backgrounds = render.load_backgrounds(screen.get_size())
+    state = GameState()
+    phase_times = {phase: [] for phase in PHASES}
+    frame_times = []
+
+    for message in messages:
+        state.apply(message)
+        render.update_animation_state(state)
+        frame_start = time.perf_counter()
+        timings = [frame_start]
+        render.draw_background(screen, state, backgrounds)
+        timings.append(time.perf_counter())
+        render.draw_tiles(screen, state)
+        timings.append(time.perf_counter())
+        render.draw_bombs(screen, state)
+        timings.append(time.perf_counter())
+        render.draw_explosions(screen, state)
+        timings.append(time.perf_counter())
+        render.draw_players(screen, state)
+        timings.append(time.perf_counter())
+        render.draw_hud(screen, state.timestamp, state.lives)  # Worst case: HUD redrawn every frame
+        timings.append(time.perf_counter())
+        pygame.event.pump()
+        state.clear_changes()
+
+        for phase, start, end in zip(PHASES, timings, timings[1:]):
+            phase_times[phase].append((end - start) * 1000)
+        frame_times.append((timings[-1] - frame_start) * 1000)
+    return frame_times, phase_times
+
+
+def percentile(values, pct):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * pct / 100))]
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Headless benchmark for draw_game / draw_hud')
+    parser.add_argument('--scenario', action='append', choices=SCENARIOS, help='default: all of them')
+    parser.add_argument('--recorded', help='JSON lines file recorded with client.py --record')
+    parser.add_argument('--frames', type=int, default=600)
+    parser.add_argument('--warmup', type=int, default=30, help='frames dropped from the results')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--budget-ms', type=float, help='fail when the p99 frame time is over this')
+    parser.add_argument('--json', action='store_true', help='print results as JSON')
+    args = parser.parse_args()
+
+    pygame.init()
+    pygame.display.set_mode((1, 1))
+    render.load_sprites()
+
+    runs = []
+    if args.recorded:
+        grid = message_grid(next(recorded_messages(args.recorded, 1)))
+        runs.append(('recorded', grid, recorded_messages(args.recorded, args.frames + args.warmup)))
+    for scenario in args.scenario or ([] if args.recorded else list(SCENARIOS)):
+        rng = random.Random(args.seed)
+        messages = view_messages if SCENARIOS[scenario].get('view') else synthetic_messages
+        runs.append((scenario, SCENARIOS[scenario]['grid'], messages(scenario, args.frames + args.warmup, rng)))
+
+    results = {}
+    failed = False
+    for name, grid, messages in runs:
+        frame_times, phase_times = run(messages, grid)
+        frame_times = frame_times[args.warmup:]
+        result = {
+            'grid': list(grid),
+            'frames': len(frame_times),
+            'p50_ms': percentile(frame_times, 50),
+            'p90_ms': percentile(frame_times, 90),
+            'p99_ms': percentile(frame_times, 99),
+            'max_ms': max(frame_times),
+            'phases_ms': {phase: statistics.mean(times[args.warmup:]) for phase, times in phase_times.items()},
+        }
+        results[name] = result
+        if args.budget_ms is not None and result['p99_ms'] > args.budget_ms:
+            failed = True
+
+    if args.json:
+        print(json.dumps(results, indent=2))
+    else:
+        print(f"{'scenario':<16} {'grid':>6} {'p50':>7} {'p90':>7} {'p99':>7} {'max':>7}   mean per phase (ms)")
+        for name, result in results.items():
+            grid = 'x'.join(map(str, result['grid']))
+            phases = '  '.join(f"{phase} {ms:.3f}" for phase, ms in result['phases_ms'].items())
+            print(f"{name:<16} {grid:>6} {result['p50_ms']:7.3f} {result['p90_ms']:7.3f} "
+                  f"{result['p99_ms']:7.3f} {result['max_ms']:7.3f}   {phases}")
+        if args.budget_ms is not None:
+            print(f"p99 budget {args.budget_ms} ms: {'FAIL' if failed else 'ok'}")
+
+    pygame.quit()
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,127 @@
+import json
+import os
+import struct
+import time
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+
+# Room checkpoints for crash recovery.
+#
+# The game loop captures a snapshot every few ticks (the only work done on the
+# tick), then a single background thread encodes it and appends it to a local
+# file as one record: <length:u32><crc32:u32><json payload>. A torn record at
+# the end of the file (crash mid-write) fails the CRC and is ignored, so
+# load_latest() always returns the last complete snapshot.
+
+HEADER = struct.Struct('<II')
+
+
+class CheckpointWriter:
+    def __init__(self, path, interval, max_bytes, capture_budget_ms):
+        self.path = path
+        self.interval = interval  # Seconds between checkpoints, doubled while over budget
+        self.base_interval = interval
+        self.max_bytes = max_bytes  # Compact the file once it grows past this
+        self.capture_budget_ms = capture_budget_ms
+        self.executor = ThreadPoolExecutor(max_workers=1)
+        self.pending = None
+        self.next_at = 0
+        # Stats
+        self.count = 0  # Records written
+        self.bytes = 0
+        self.failures = 0
+        self.skipped = 0
+        self.captures = 0
+        self.capture_ms_total = 0.0
+        self.capture_ms_max = 0.0
+        self.write_ms_last = 0.0
+
+    def maybe_checkpoint(self, capture):
+        # Called once per tick. Takes a snapshot when the interval elapsed and
+        # hands it to the writer thread; never waits on the disk.
+        now = time.monotonic()
+        if now < self.next_at:
+            return
+        self.next_at = now + self.interval
+        if self.pending is not None:
+            if not self.pending.done():
+                self.skipped += 1  # Previous write still running, never queue a backlog
+                return
+            error = self.pending.exception()
+            if error is not None:
+                self.failures += 1
+                print(f"Checkpoint write failed: {error!r}")
+            self.pending = None
+
+        start = time.perf_counter()
+        record = capture()
+        capture_ms = (time.perf_counter() - start) * 1000
+        self.captures += 1
+        self.capture_ms_total += capture_ms
+        self.capture_ms_max = max(self.capture_ms_max, capture_ms)
+        # Keep the amortized cost bounded: back off while captures are over budget
+        if capture_ms > self.capture_budget_ms:
+            self.interval = min(self.interval * 2, self.base_interval * 16)
+        else:
+            self.interval = self.base_interval
+
+        self.pending = self.executor.submit(self._write, record)
+
+    def stats(self):
+        return {
+            'count': self.count,
+            'bytes': self.bytes,
+            'failures': self.failures,
+            'skipped': self.skipped,
+            'last_write_ms': round(self.write_ms_last, 3),
+            'capture_ms_avg': round(self.capture_ms_total / self.captures, 3) if self.captures else 0.0,
+            'capture_ms_max': round(self.capture_ms_max, 3),
+            'interval_s': self.interval,
+        }
+
+    def summary(self):
+        stats = self.stats()
+        return (f"checkpoints={stats['count']} bytes={stats['bytes']} failures={stats['failures']} "
+                f"skipped={stats['skipped']} capture avg={stats['capture_ms_avg']:.3f}ms "
+                f"max={stats['capture_ms_max']:.3f}ms write={stats['last_write_ms']:.3f}ms "
+                f"interval={stats['interval_s']}s")
+
+    def _write(self, record):
+        start = time.perf_counter()
+        payload = json.dumps(record, separators=(',', ':')).encode()
+        data = HEADER.pack(len(payload), zlib.crc32(payload)) + payload
+        if os.path.exists(self.path) and os.path.getsize(self.path) + len(data) > self.max_bytes:
+            # Compact: start a fresh file holding only the newest record
+            tmp_path = self.path + '.tmp'
+            with open(tmp_path, 'wb') as f:
+                f.write(data)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp_path, self.path)
+        else:
+            with open(self.path, 'ab') as f:
+                f.write(data)
+                f.flush()
+        # Only counted once the record is on disk; a failure propagates to the future
+        self.count += 1
+        self.bytes += len(data)
+        self.write_ms_last = (time.perf_counter() - start) * 1000
+
+
+def load_latest(path):
+    # Last complete record in the file, or None
+    try:
+        with open(path, 'rb') as f:
+            data = f.read()
+    except FileNotFoundError:
+        return None
+    latest = None
+    offset = 0
+    while offset + HEADER.size <= len(data):
+        length, crc = HEADER.unpack_from(data, offset)
+        payload = data[offset + HEADER.size:offset + HEADER.size + length]
+        if len(payload) < length or zlib.crc32(payload) != crc:
+            break  # Torn or corrupted tail
+        latest = payload
+        offset += HEADER.size + length
+    return json.loads(latest) if latest is not None else None
@@ -3,87 +3,63 @@ import time
 import sys
 import asyncio
 import json
-import copy
 
 from settings import *
+from client_state import GameState
+from protocol import UP, DOWN, LEFT, RIGHT, PLACE_BOMB, pack_input
+from timesync import ClockSync, pong
+from render import (load_sprites, load_backgrounds, update_animation_state, draw_background,
+                    draw_game, draw_hud, fit_tile_size)
 
-async def main():
+async def main(uri=None, spectate=False, record=None):
     # Initialize Pygame
     pygame.init()
 
-    # Set up display
-    screen = pygame.display.set_mode((SCREEN_WIDTH, SCREEN_HEIGHT))
+    # Set up display, with tiles small enough for the whole grid to fit on the screen
+    display = pygame.display.Info()
+    tile_size = fit_tile_size((GRID_WIDTH, GRID_HEIGHT), (display.current_w, display.current_h))
+    screen = pygame.display.set_mode((GRID_WIDTH * tile_size, GRID_HEIGHT * tile_size + HUD_HEIGHT))
     pygame.display.set_caption("Overblocked")
 
 
     # Background image
-    mapa_1 = pygame.image.load('./assets/maps/mapa_neve_com_pedra.png').convert()
-    mapa_1 = pygame.transform.scale(mapa_1, (SCREEN_WIDTH, SCREEN_HEIGHT - HUD_HEIGHT))
+    backgrounds = load_backgrounds(screen.get_size())
 
-    mapa_2 = pygame.image.load('./assets/maps/mapa_verde_com_pedra.png').convert()
-    mapa_2 = pygame.transform.scale(mapa_2, (SCREEN_WIDTH, SCREEN_HEIGHT - HUD_HEIGHT))
-
-    mapa_3 = pygame.image.load('./assets/maps/mapa_areia_com_pedra.png').convert()
-    mapa_3 = pygame.transform.scale(mapa_3, (SCREEN_WIDTH, SCREEN_HEIGHT - HUD_HEIGHT))
-
-    # Connect to server
-    uri = f"ws://{SERVER_URL}:{SERVER_PORT}"
+    # Connect to server (spectators watch through /spectate and never send input)
+    if uri is None:
+        uri = f"ws://{SERVER_URL}:{SERVER_PORT}" + ("/spectate" if spectate else "")
     try:
-        websocket = await asyncio.wait_for(websockets.connect(uri), timeout=5)
+        websocket = await connect(uri, 5)
     except Exception as e:
         print(f"Unable to connect to server: {e}")
         pygame.quit()
         return
 
-    # Create clock object to manage frame rate
-    clock = pygame.time.Clock()
+    # Game state, updated in place by every message from the server
+    state = GameState()
+    clock = ClockSync(CLOCK_SAMPLES)  # Server clock offset and RTT, from pings and snapshots
+    hud_drawn = False
+    record_file = open(record, 'w') if record else None
+    receiver = asyncio.create_task(receive_states(websocket, state, clock, record_file))
 
-    # Variables to store game state
-    game_state = [None, None]  # [Current State, Previous State]
+    # Input is edge-triggered: only sent when the keys change, plus a keepalive
+    input_seq = 0
+    last_keys = None
+    last_sent = 0
+    last_ping = 0
+    watching = spectate
 
     # Main loop
     running = True
+    next_frame = time.perf_counter()
 
     # Loading sprites
-    global player1_animations, player2_animations, player1_idle_sprite, player2_idle_sprite, trunk_sprite, rock_sprite, mango_bomb_sprite, venom_bomb_sprite, mango_bomb_animation, venom_bomb_animation
-
-    player1_animations = load_player1_animation_frames()
-    player2_animations = load_player2_animation_frames()
-    player1_idle_sprite = pygame.image.load(
-        'assets/caco-idle.png').convert_alpha()
-    player2_idle_sprite = pygame.image.load(
-        'assets/cobra-idle.png').convert_alpha()
-    trunk_sprite = pygame.image.load('assets/trunk.png').convert_alpha()
-    rock_sprite = pygame.image.load('assets/rock.png').convert_alpha()
-    #mango_bomb_sprite = pygame.image.load(
-    #    'assets/mango-bomb.png').convert_alpha()
-    #mango_bomb_sprite = pygame.transform.scale(mango_bomb_sprite, (65, 65))
-    #venom_bomb_sprite = pygame.image.load(
-    #    'assets/venom-bomb.png').convert_alpha()
-    #venom_bomb_sprite = pygame.transform.scale(venom_bomb_sprite, (65, 65))
-
-    global bomb_start_times
-    bomb_start_times = {}
-    mango_bomb_animation = [pygame.transform.scale(pygame.image.load(f'./assets/bomb-mango-animation/{i}.png').convert_alpha(), (60, 60)) for i in range(1, 6)]
-    venom_bomb_animation = [pygame.transform.scale(pygame.image.load(f'./assets/bomb-venom-animation/{i}.png').convert_alpha(), (60, 60)) for i in range(1, 6)]
-
-    animation_state = {
-        '0': {
-            'direction': 'down',
-            'frame': 0,
-            'last_update': time.time(),
-            'is_moving': False
-        },
-        '1': {
-            'direction': 'down',
-            'frame': 0,
-            'last_update': time.time(),
-            'is_moving': False
-        }
-    }
+    load_sprites(tile_size)
 
     while running:
-        dt = clock.tick(60)  # Delta time in milliseconds
+        # ~60 FPS; sleeping on the event loop lets the receiver apply server messages meanwhile
+        next_frame = max(next_frame + 1 / 60, time.perf_counter())
+        await asyncio.sleep(next_frame - time.perf_counter())
 
         for event in pygame.event.get():
             if event.type == pygame.QUIT:
@@ -91,237 +67,126 @@ async def main():
 
         # Get key presses
         keys = pygame.key.get_pressed()
-        controller_input = {
-            'up': keys[pygame.K_UP] or keys[pygame.K_w],
-            'down': keys[pygame.K_DOWN] or keys[pygame.K_s],
-            'left': keys[pygame.K_LEFT] or keys[pygame.K_a],
-            'right': keys[pygame.K_RIGHT] or keys[pygame.K_d],
-            'place_bomb': keys[pygame.K_SPACE]
-        }
-
-        # Send input to server
-        input_data = {'controller': controller_input}
-        await websocket.send(json.dumps(input_data))
+        input_keys = 0
+        if keys[pygame.K_UP] or keys[pygame.K_w]:
+            input_keys |= UP
+        if keys[pygame.K_DOWN] or keys[pygame.K_s]:
+            input_keys |= DOWN
+        if keys[pygame.K_LEFT] or keys[pygame.K_a]:
+            input_keys |= LEFT
+        if keys[pygame.K_RIGHT] or keys[pygame.K_d]:
+            input_keys |= RIGHT
+        if keys[pygame.K_SPACE]:
+            input_keys |= PLACE_BOMB
+
+        if not spectate and state.spectating != watching:
+            # No free player slot, the server sends us the match to watch (until a
+            # reconnect gets us a slot): no input and no pings meanwhile
+            watching = state.spectating
+            if watching:
+                print("Server is full, spectating")
+            pygame.display.set_caption("Overblocked - server full, spectating" if watching else "Overblocked")
 
-        # Receive game state from server
         try:
-            message = await websocket.recv()
-            if game_state[0]:
-                game_state[1] = copy.deepcopy(game_state[0])
-            game_state[0] = json.loads(message)
+            # Send input to server
+            if not watching and (input_keys != last_keys or time.monotonic() - last_sent >= INPUT_KEEPALIVE):
+                input_seq = (input_seq + 1) & 0xFFFF
+                await websocket.send(pack_input(input_seq, input_keys))
+                last_keys = input_keys
+                last_sent = time.monotonic()
+
+            # Clock sync, a few quick pings first to fill the sample window
+            ping_interval = PING_INTERVAL if len(clock.samples) >= 3 else 0.2
+            if not watching and time.monotonic() - last_ping >= ping_interval:
+                await websocket.send(clock.ping())
+                last_ping = time.monotonic()
+
+            if receiver.done():
+                receiver.result()  # Re-raises ConnectionClosed
 
         except websockets.exceptions.ConnectionClosed:
-            print("Server connection closed")
-            running = False
-            break
+            # The server may be restarting from a checkpoint, try to reattach
+            print("Server connection closed, reconnecting...")
+            receiver.cancel()
+            try:
+                # With our session token the server gives us back the same player slot
+                websocket = await connect(session_uri(uri, state.session), RECONNECT_TIMEOUT)
+            except Exception as e:
+                print(f"Unable to reconnect to server: {e}")
+                running = False
+                break
+            receiver = asyncio.create_task(receive_states(websocket, state, clock, record_file))
+            last_keys = None  # Resend the current keys on the new connection
+            continue
 
-        # Clear the screen and redraw the grid and HUD
-        match sum(game_state[0]['lives'])%3:
-            case 0:
-                background_image = mapa_1
-            case 1:
-                background_image = mapa_2
-            case 2:
-                background_image = mapa_3
-            case _:
-                background_image = mapa_1
-        screen.blit(background_image, (0, HUD_HEIGHT))
+        if not state.received:
+            continue
 
-        if game_state[0]:
-            if game_state[1]:
-                update_animation_state(game_state[0]['players'], game_state[1]['players'], animation_state)
-                # print('==   Game State   ==')
-                # print(game_state[0])
-                # print('== Animation State ==')
-                # print(animation_state)
-            else:
-                # No previous state, set is_moving to False
-                for id in animation_state:
-                    animation_state[id]['is_moving'] = False
+        # Clear the screen and redraw the grid and HUD
+        draw_background(screen, state, backgrounds)
 
-            draw_game(screen, game_state[0], animation_state)
-            draw_hud(screen, game_state[0]['timestamp'], game_state[0]['lives'])
+        update_animation_state(state)
+        state.interpolate(clock.server_now(), (clock.rtt or 0.0) / 2)
+        draw_game(screen, state)
+        # Nothing else draws over the HUD, so it is only redrawn when it changes
+        if state.lives_changed or state.timer_changed or not hud_drawn:
+            draw_hud(screen, state.timestamp, state.lives)
+            hud_drawn = True
+        state.clear_changes()
 
         # Update display
         pygame.display.flip()
 
     # Quit Pygame
+    receiver.cancel()
+    if record_file:
+        record_file.close()
     pygame.quit()
 
 
-def update_animation_state(players_current_state: dict, players_last_state: dict, animation_state: dict) -> None:
-    """
-    in: (
-            {"0": [3.0, 2.0], "1": [12.0, 9.0]},
-            {"0": [2.9, 2.0], "1": [12.1, 9.0]}
-        )
-    """
-    if players_current_state.keys() == players_last_state.keys():
-        for id in players_current_state:
-            dx = players_current_state[id][0] - players_last_state[id][0]
-            dy = players_current_state[id][1] - players_last_state[id][1]
-            animation_state[id]['is_moving'] = dx != 0 or dy != 0
-            if (dx < 0 and dy < 0) or (dy < 0 and dx == 0):
-                animation_state[id]['direction'] = 'up'
-            elif (dx > 0 and dy > 0) or (dy > 0 and dx == 0):
-                animation_state[id]['direction'] = 'down'
-            elif (dx < 0):
-                animation_state[id]['direction'] = 'left'
-            elif (dx > 0):
-                animation_state[id]['direction'] = 'right'
-            else:
-                animation_state[id]['is_moving'] = False
-
-    current_time = time.time()
-    for id in animation_state:
-        if animation_state[id]['is_moving']:
-            if current_time - animation_state[id]['last_update'] > 0.1:
-                if id == '0':
-                    frames = player1_animations[animation_state[id]['direction']]
-                elif id == '1':
-                    frames = player2_animations[animation_state[id]['direction']]
-                else:
-                    continue
-
-                animation_state[id]['frame'] = (
-                    animation_state[id]['frame'] + 1) % len(frames)
-                animation_state[id]['last_update'] = current_time
-        else:
-            animation_state[id]['frame'] = 0
-
-
-def draw_game(screen, game_state, animation_state):
-    # Draw the map
-    map_matrix = game_state['map']
-    for row in range(len(map_matrix)):
-        for col in range(len(map_matrix[0])):
-            cell_value = map_matrix[row][col]
-            color = BACKGROUND_COLOR
-            if cell_value == 1:
-                # screen.blit(rock_sprite, (col * TILE_SIZE,
-                #             row * TILE_SIZE + HUD_HEIGHT))
-                color = OBSTACLE_COLOR  # Unbreakable
-            elif cell_value == 2:
-                screen.blit(trunk_sprite, (col * TILE_SIZE,
-                            row * TILE_SIZE + HUD_HEIGHT))
-                color = BREAKABLE_COLOR  # Breakable
-            elif cell_value == -2:
-                color = BREAKING_COLOR  # Breaking
-                pygame.draw.rect(screen, color, (col * TILE_SIZE,
-                                 row * TILE_SIZE + HUD_HEIGHT, TILE_SIZE, TILE_SIZE))
-            elif cell_value == 3:
-                # screen.blit(mango_bomb_sprite, (col * TILE_SIZE, row * TILE_SIZE + HUD_HEIGHT))
-                color = BOMB_COLOR  # Bomb
-
-            # pygame.draw.rect(screen, GRID_COLOR, (col * TILE_SIZE, row * TILE_SIZE + HUD_HEIGHT, TILE_SIZE, TILE_SIZE), 1)
-
-    # Draw bombs with animation
-    EXPLOSION_DURATION=3000
-    for bomb in game_state['bombs']:
-        x = bomb['x']
-        y = bomb['y']
-        pixel_x = x * TILE_SIZE
-        pixel_y = y * TILE_SIZE + HUD_HEIGHT
-
-        # Get or set the start time of the bomb
-        if (bomb['x'], bomb['y']) not in bomb_start_times:
-            bomb_start_times[(bomb['x'], bomb['y'])] = pygame.time.get_ticks()
-
-        # Calculate time elapsed since bomb was placed
-        elapsed_time = pygame.time.get_ticks() - bomb_start_times[(bomb['x'], bomb['y'])]
-
-        # Determine the current frame of the animation based on elapsed time
-        frame_index = (elapsed_time // (EXPLOSION_DURATION // len(mango_bomb_animation))) % len(mango_bomb_animation)
-
-        # Choose the correct animation frames based on player ID
-        if bomb['player_id'] == 0:
-            current_frame = mango_bomb_animation[frame_index]  # Mango bomb animation
-        elif bomb['player_id'] == 1:
-            current_frame = venom_bomb_animation[frame_index]  # Venom bomb animation
-        else:
+async def receive_states(websocket, state, clock, record_file=None):
+    # Apply every message from the server to the state store as soon as it arrives
+    async for message in websocket:
+        received_at = time.monotonic()
+        data = json.loads(message)
+        if data.get('type') == 'pong':
+            clock.on_pong(data, received_at)
             continue
-
-        # Draw the current frame of the bomb
-        screen.blit(current_frame, (pixel_x, pixel_y))
-
-        # Check if the bomb should explode (if elapsed time is greater than EXPLOSION_DURATION)
-        if elapsed_time > EXPLOSION_DURATION:
-            # Remove the bomb from the dictionary once it explodes to clean up
-            del bomb_start_times[(bomb['x'], bomb['y'])]
-            # Trigger explosion here (e.g., update game state or call explosion logic)
-
-    # Draw explosions
-    for explosion in game_state['explosions']:
-        bomb_type = explosion['bomb_type']
-        if bomb_type == 'BOMB_TYPE_1':
-            color = PLAYER1_EXPLOSION_COLOR
-        elif bomb_type == 'BOMB_TYPE_2':
-            color = PLAYER2_EXPLOSION_COLOR
-        else:
-            color = (255, 0, 0)  # Default color if bomb_type is unknown
-        for sector in explosion['sectors']:
-            x, y = sector
-            pixel_x = x * TILE_SIZE
-            pixel_y = y * TILE_SIZE + HUD_HEIGHT
-            pygame.draw.rect(
-                screen, color, (pixel_x, pixel_y, TILE_SIZE, TILE_SIZE))
-
-    # Draw players
-    for id, (x,y) in game_state['players'].items():
-        pixel_x = x * TILE_SIZE  # Calculate pixel_x here
-        pixel_y = y * TILE_SIZE + HUD_HEIGHT  # Calculate pixel_y here
-
-        direction = animation_state[id]['direction']
-        frame = animation_state[id]['frame']
-        if id == '0':
-            sprite = player1_animations[direction][frame]
-        elif id == '1':
-            sprite = player2_animations[direction][frame]
-        else:
+        if data.get('type') == 'ping':
+            await websocket.send(pong(data))  # The server measuring our RTT
             continue
-
-        sprite_width, sprite_height = sprite.get_size()
-        centralized_x = pixel_x + (TILE_SIZE - sprite_width) // 2
-        centralized_y = pixel_y  # A altura já é a mesma, então não precisa ajustar
-        # Use the player sprite at the calculated pixel coordinates
-        screen.blit(sprite, (centralized_x, centralized_y))
+        if 'server_time' in data:
+            clock.on_snapshot(data['server_time'], received_at)
+        state.apply(data)
+        if record_file and state.received and data.get('type') not in ('welcome', 'spectating'):
+            record_file.write(message + '\n')  # One JSON message per line, for bench_render.py
+    raise websockets.exceptions.ConnectionClosed(None, None)
 
 
-def draw_hud(screen, timer, lives):
-    # Create a black background for the HUD
-    pygame.draw.rect(screen, HUD_COLOR, (0, 0, SCREEN_WIDTH, HUD_HEIGHT))
-    font = pygame.font.SysFont(None, 36)
-    # Player 1's lives (left corner)
-    text_p1 = font.render(f"P1 Lives: {lives[0]}", True, (255, 255, 255))
-    screen.blit(text_p1, (10, 10))
-    # Player 2's lives (right corner)
-    text_p2 = font.render(f"P2 Lives: {lives[1]}", True, (255, 255, 255))
-    screen.blit(text_p2, (SCREEN_WIDTH - 150, 10))
-    # Timer in the middle
-    text_timer = font.render(f"Timer: {int(timer)}", True, (255, 255, 255))
-    screen.blit(text_timer, (SCREEN_WIDTH // 2 - 50, 10))
+def session_uri(uri, session):
+    if session is None:
+        return uri
+    return uri + ('&' if '?' in uri else '?') + 'session=' + session
 
 
-def load_player1_animation_frames():
-    animations = {
-        'down': [pygame.transform.scale(pygame.image.load(f'assets/caco-walking-down-animation/caco-walking-down-frame-{i}.png').convert_alpha(), (65, 80)) for i in range(1, 9)],
-        'up': [pygame.transform.scale(pygame.image.load(f'assets/caco-walking-up-animation/caco-walking-up-frame-{i}.png').convert_alpha(), (65, 80)) for i in range(1, 9)],
-        'left': [pygame.transform.scale(pygame.image.load(f'assets/caco-walking-left-animation/caco-walking-left-frame-{i}.png').convert_alpha(), (65, 80)) for i in range(1, 9)],
-        'right': [pygame.transform.scale(pygame.image.load(f'assets/caco-walking-right-animation/caco-walking-right-frame-{i}.png').convert_alpha(), (65, 80)) for i in range(1, 9)],
-    }
-    return animations
-
-
-def load_player2_animation_frames():
-    animations = {
-        'down': [pygame.transform.scale(pygame.image.load(f'assets/cobra-walking-right-animation/cobra-right-{i}.png').convert_alpha(), (75, 80)) for i in range(1, 9)],
-        'up': [pygame.transform.scale(pygame.image.load(f'assets/cobra-walking-left-animation/cobra-left-{i}.png').convert_alpha(), (75, 80)) for i in range(1, 9)],
-        'left': [pygame.transform.scale(pygame.image.load(f'assets/cobra-walking-left-animation/cobra-left-{i}.png').convert_alpha(), (75, 80)) for i in range(1, 9)],
-        'right': [pygame.transform.scale(pygame.image.load(f'assets/cobra-walking-right-animation/cobra-right-{i}.png').convert_alpha(), (75, 80)) for i in range(1, 9)],
-    }
-    return animations
+async def connect(uri, timeout):
+    # Retry until the server accepts the connection or the timeout runs out
+    deadline = time.monotonic() + timeout
+    while True:
+        try:
+            return await asyncio.wait_for(websockets.connect(uri), timeout=max(deadline - time.monotonic(), 0.1))
+        except Exception:
+            if time.monotonic() >= deadline:
+                raise
+            await asyncio.sleep(0.1)
 
 
 if __name__ == '__main__':
+    import argparse
     import websockets
-    asyncio.run(main())
+    parser = argparse.ArgumentParser(description='Overblocked client')
+    parser.add_argument('--url', help='server or spectator relay URL (default: from settings.toml)')
+    parser.add_argument('--spectate', action='store_true', help='watch the match without taking a player slot')
+    parser.add_argument('--record', help='save every server message to this file (JSON lines)')
+    args = parser.parse_args()
+    asyncio.run(main(args.url, args.spectate, args.record))
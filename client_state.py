@@ -0,0 +1,268 @@
+import time
+from array import array
+from itertools import islice
+
+from settings import MAX_PLAYERS
+
+# Client-side game state. Every message from the server is applied in place
+# to the same preallocated objects (no dict trees kept around, no deepcopy),
+# and the *_changed flags tell animation and rendering what changed since
+# the last frame. Call clear_changes() once the frame has been drawn.
+#
+# Keyframes carry the whole map, deltas only the cells written since the
+# previous tick. A delta that does not follow the last applied tick (nothing
+# applied yet, or a message was lost) is ignored until the next keyframe.
+# Players get views instead (see interest.py): the map cells of the chunks
+# around them and everyone's coarse position for the rest of the room.
+#
+# Players are drawn between their last two snapshot positions; interpolate()
+# places them for the current estimate of the server clock (see timesync.py).
+
+
+class PlayerState:
+    __slots__ = ('player_id', 'key', 'present', 'x', 'y',
+                 'from_x', 'from_y', 'draw_x', 'draw_y',
+                 'direction', 'frame', 'last_update', 'is_moving')
+
+    def __init__(self, player_id):
+        self.player_id = player_id
+        self.key = str(player_id)  # JSON object keys are strings
+        self.present = False
+        self.x = self.y = 0.0
+        self.from_x = self.from_y = 0.0  # Position in the snapshot before the last one
+        self.draw_x = self.draw_y = 0.0  # Interpolated position to draw
+        # Animation state
+        self.direction = 'down'
+        self.frame = 0
+        self.last_update = time.time()
+        self.is_moving = False
+
+
+class BombState:
+    __slots__ = ('x', 'y', 'player_id', 'placed_at')
+
+    def __init__(self):
+        self.x = self.y = 0
+        self.player_id = 0
+        self.placed_at = None  # Server clock
+
+
+class ExplosionState:
+    __slots__ = ('sectors', 'bomb_type', 'player_id')
+
+    def __init__(self):
+        self.sectors = []
+        self.bomb_type = None
+        self.player_id = None
+
+
+class GameState:
+    __slots__ = ('players', 'bombs', 'bomb_count', 'explosions', 'explosion_count',
+                 'width', 'height', 'cells', 'block_cells', 'lives', 'timestamp', 'received',
+                 'tick', 'revision', 'player_id', 'session', 'spectating', 'server_time', 'prev_server_time', 'server_now',
+                 'map_changed', 'players_changed', 'bombs_changed', 'explosions_changed',
+                 'lives_changed', 'timer_changed')
+
+    def __init__(self, max_players=MAX_PLAYERS):
+        self.players = [PlayerState(player_id) for player_id in range(max_players)]
+        # Bomb and explosion pools, only the first *_count entries are live
+        self.bombs = []
+        self.bomb_count = 0
+        self.explosions = []
+        self.explosion_count = 0
+        self.width = self.height = 0
+        self.cells = array('b')  # Map matrix, row-major
+        self.block_cells = []  # (x, y, value) of breakable/breaking blocks, rebuilt when the map changes
+        self.lives = [0] * max_players
+        self.timestamp = 0.0
+        self.received = False
+        self.tick = None  # Server tick of the last applied snapshot
+        self.revision = None  # Map revision the view chunks belong to
+        self.player_id = None  # Our player slot and session token, from the welcome message
+        self.session = None
+        self.spectating = False  # The server was full and sends us the spectator stream
+        self.server_time = self.prev_server_time = None  # Server clock of the last two snapshots
+        self.server_now = None  # Server clock estimate for the frame being drawn
+        self.clear_changes()
+
+    def cell(self, x, y):
+        return self.cells[y * self.width + x]
+
+    def active_bombs(self):
+        return islice(self.bombs, self.bomb_count)
+
+    def active_explosions(self):
+        return islice(self.explosions, self.explosion_count)
+
+    def apply(self, message):
+        # Update the state in place from a decoded server message
+        kind = message.get('type')
+        if kind == 'welcome':
+            self.player_id = message['player_id']
+            self.session = message['session']
+            self.spectating = False
+            return
+        if kind == 'spectating':
+            self.spectating = True
+            return
+        if 'map' in message:
+            self._apply_map(message['map'])
+        elif kind == 'view':
+            self._apply_chunks(message)
+        elif kind != 'delta' or message.get('base') != self.tick:
+            return  # Not a snapshot (e.g. an RTT ping), or a delta on top of a tick we do not have
+        else:
+            self._apply_cells(message['cells'])
+        self.tick = message.get('tick')
+        players = message['players']
+        if 'far_players' in message:
+            players = {**message['far_players'], **players}  # Precise positions in view, coarse outside
+        self._apply_players(players)
+        self._apply_bombs(message['bombs'])
+        self._apply_explosions(message['explosions'])
+        self._apply_lives(message['lives'])
+        timestamp = message['timestamp']
+        if int(timestamp) != int(self.timestamp):
+            self.timer_changed = True
+        self.timestamp = timestamp
+        self.prev_server_time, self.server_time = self.server_time, message.get('server_time')
+        self.received = True
+
+    def interpolate(self, server_now, latency=0.0):
+        # Place every player for this frame. server_now is the estimated server clock and
+        # latency the one-way delay; the render time trails the newest snapshot by one
+        # snapshot interval, so it moves from the previous position to the newest one
+        # over the time it takes the next snapshot to arrive.
+        self.server_now = server_now
+        previous, latest = self.prev_server_time, self.server_time
+        if server_now is None or previous is None or latest is None or latest <= previous:
+            return
+        span = latest - previous
+        alpha = min(max((server_now - latency - span - previous) / span, 0.0), 1.0)
+        for player in self.players:
+            if player.present:
+                player.draw_x = player.from_x + (player.x - player.from_x) * alpha
+                player.draw_y = player.from_y + (player.y - player.from_y) * alpha
+
+    def clear_changes(self):
+        self.map_changed = self.players_changed = self.bombs_changed = False
+        self.explosions_changed = self.lives_changed = self.timer_changed = False
+
+    def _apply_map(self, rows):
+        height, width = len(rows), len(rows[0])
+        cells = self.cells
+        changed = False
+        if (width, height) != (self.width, self.height):
+            self.width, self.height = width, height
+            cells = self.cells = array('b', bytes(width * height))
+            changed = True
+        i = 0
+        for row in rows:
+            for value in row:
+                if cells[i] != value:
+                    cells[i] = value
+                    changed = True
+                i += 1
+        if changed:
+            self._map_changed()
+
+    def _apply_cells(self, changes):
+        cells, width = self.cells, self.width
+        changed = False
+        for x, y, value in changes:
+            i = y * width + x
+            if cells[i] != value:
+                cells[i] = value
+                changed = True
+        if changed:
+            self._map_changed()
+
+    def _apply_chunks(self, message):
+        width, height = message['width'], message['height']
+        changed = False
+        if (width, height) != (self.width, self.height) or message['revision'] != self.revision:
+            # New map: nothing is known until its chunks arrive
+            self.width, self.height = width, height
+            self.cells = array('b', bytes(width * height))
+            self.revision = message['revision']
+            changed = True
+        cells = self.cells
+        for x0, y0, rows in message['chunks'].values():
+            for y, row in enumerate(rows, y0):
+                i = y * width + x0
+                for value in row:
+                    if cells[i] != value:
+                        cells[i] = value
+                        changed = True
+                    i += 1
+        if changed:
+            self._map_changed()
+
+    def _map_changed(self):
+        width = self.width
+        self.map_changed = True
+        self.block_cells = [
+            (i % width, i // width, value)
+            for i, value in enumerate(self.cells) if value == 2 or value == -2
+        ]
+
+    def _apply_players(self, positions):
+        for key in positions:
+            while int(key) >= len(self.players):
+                self.players.append(PlayerState(len(self.players)))
+                self.lives.append(0)
+        for player in self.players:
+            position = positions.get(player.key)
+            if position is None:
+                if player.present:
+                    player.present = False
+                    self.players_changed = True
+                continue
+            x, y = position
+            if not player.present:
+                # First appearance: no previous position to animate from
+                player.present = True
+                player.x, player.y = x, y
+                self.players_changed = True
+            player.from_x, player.from_y = player.x, player.y
+            player.draw_x, player.draw_y = x, y
+            if x != player.x or y != player.y:
+                player.x, player.y = x, y
+                self.players_changed = True
+
+    def _apply_bombs(self, bombs):
+        while len(self.bombs) < len(bombs):
+            self.bombs.append(BombState())
+        changed = len(bombs) != self.bomb_count
+        for bomb, data in zip(self.bombs, bombs):
+            x, y, player_id = data['x'], data['y'], data['player_id']
+            if bomb.x != x or bomb.y != y or bomb.player_id != player_id:
+                bomb.x, bomb.y, bomb.player_id = x, y, player_id
+                changed = True
+            bomb.placed_at = data.get('placed_at')
+        self.bomb_count = len(bombs)
+        if changed:
+            self.bombs_changed = True
+
+    def _apply_explosions(self, explosions):
+        while len(self.explosions) < len(explosions):
+            self.explosions.append(ExplosionState())
+        changed = len(explosions) != self.explosion_count
+        for explosion, data in zip(self.explosions, explosions):
+            sectors, player_id = data['sectors'], data.get('player_id')
+            if explosion.sectors != sectors or explosion.player_id != player_id:
+                explosion.sectors = sectors  # Kept by reference, the message is not reused
+                explosion.player_id = player_id
+                changed = True
+            explosion.bomb_type = data['bomb_type']
+        self.explosion_count = len(explosions)
+        if changed:
+            self.explosions_changed = True
+
+    def _apply_lives(self, lives):
+        if len(lives) > len(self.lives):
+            self.lives.extend([0] * (len(lives) - len(self.lives)))
+        for player_id, value in enumerate(lives):
+            if self.lives[player_id] != value:
+                self.lives[player_id] = value
+                self.lives_changed = True
@@ -1,37 +1,184 @@
-import pygame
-import threading
 import time
-import sys
 import copy
+import random
 from enum import Enum
-from math import ceil
 
 from settings import *
 
 # Global lists and variables
-lives = []
+# Per-player state is indexed by player ID (0 .. MAX_PLAYERS - 1)
+lives = [0] * MAX_PLAYERS
 bombs = []
 explosions = []
-players = []
-placed_bombs = [0, 0]  # Track placed bombs per player (2 players)
+players = {}  # player_id -> Player
+placed_bombs = [0] * MAX_PLAYERS  # Track placed bombs per player
 current_map_number = 0  # To keep track of the current map
 
+FP_ONE = 10 ** PRECISION  # Fixed-point sub-tile units per tile for player positions
+BLOCKING_CELLS = (1, 2, 3)  # Unbreakable, breakable and bomb cells block movement
+
 def reset_game():
-    lives.clear()  # Clears the list but keeps the reference intact
-    lives.extend([PLAYER_LIVES, PLAYER_LIVES])  # Modify the existing list
+    # Only joined players get lives, empty slots stay at 0
+    for player_id in range(MAX_PLAYERS):
+        lives[player_id] = PLAYER_LIVES if player_id in players else 0
     reset_round()
 
 def reset_round():
-    # Reset players' positions instead of recreating them
-    for player in players:
-        if player.player_id == 0:
-            player.__init__(1, 1, "BOMB_TYPE_1", 0)
-        elif player.player_id == 1:
-            player.__init__(map.width - 2, map.height - 2, "BOMB_TYPE_2", 1)
     explosions.clear()
     bombs.clear()
-    placed_bombs[:] = [0,0]
+    placed_bombs[:] = [0] * MAX_PLAYERS
     map.next_map()
+    # Reset players' positions instead of recreating them (spawn points come from the new map)
+    for player in players.values():
+        player.__init__(*map.spawn_points[player.player_id], player.bomb_type, player.player_id)
+
+def add_player(player_id):
+    player = Player(*map.spawn_points[player_id], f"BOMB_TYPE_{player_id + 1}", player_id)
+    players[player_id] = player
+    lives[player_id] = PLAYER_LIVES
+    return player
+
+def remove_player(player_id):
+    players.pop(player_id, None)
+    lives[player_id] = 0
+
+def free_player_slot():
+    # Lowest player ID that is not taken, or None if the match is full
+    for player_id in range(min(MAX_PLAYERS, len(map.spawn_points))):
+        if player_id not in players:
+            return player_id
+    return None
+
+def alive_players():
+    return sum(1 for player_id in players if lives[player_id] > 0)
+
+def update():
+    # Advance bombs and explosions by one tick
+    for bomb in bombs[:]:
+        if not bombs:
+            break  # A round reset cleared the remaining bombs
+        bomb.update()
+    for explosion in explosions[:]:
+        explosion.update()
+
+def snapshot():
+    # Compact copy of the room for checkpoints: plain lists, timers stored as ages
+    now = time.time()
+    return {
+        'grid': [map.width, map.height],
+        'map_number': map.map_number,
+        'map': [row[:] for row in map.matrix],
+        'lives': lives[:],
+        'placed_bombs': placed_bombs[:],
+        'players': [
+            [p.player_id, p.x, p.y, p.bomb_type, p.just_placed_bomb, max(p.bomb_ready_at - now, 0)]
+            for p in players.values()
+        ],
+        'bombs': [[b.x, b.y, b.player_id, b.bomb_type, now - b.placed_at] for b in bombs],
+        'explosions': [
+            [e.x, e.y, e.range, e.bomb_type, e.player_id, e.sectors, e.blocks_to_destroy, now - e.start_time]
+            for e in explosions
+        ],
+    }
+
+def snapshot_mismatch(snapshot):
+    # Why a snapshot cannot be restored into this room (settings changed since), or None
+    grid = snapshot.get('grid')
+    if grid != [map.width, map.height]:
+        return f"grid {grid} does not match the configured {map.width}x{map.height}"
+    if not 0 <= snapshot['map_number'] < len(map.maps):
+        return f"map {snapshot['map_number']} does not exist"
+    if len(snapshot['lives']) != MAX_PLAYERS:
+        return f"saved for {len(snapshot['lives'])} players, max_players is {MAX_PLAYERS}"
+    return None
+
+def restore(snapshot):
+    # Rebuild the room from snapshot(), timers keep the age they had when it was taken
+    mismatch = snapshot_mismatch(snapshot)
+    if mismatch:
+        raise ValueError(mismatch)
+    now = time.time()
+    map.map_number = snapshot['map_number']
+    map.matrix = snapshot['map']
+    map.spawn_points = find_spawn_points(map.maps[map.map_number])
+    map.revision += 1
+    map.changes.clear()
+    map.rebuild_walkability()
+    lives[:] = snapshot['lives']
+    placed_bombs[:] = snapshot['placed_bombs']
+    players.clear()
+    for player_id, x, y, bomb_type, just_placed_bomb, cooldown in snapshot['players']:
+        player = Player(x, y, bomb_type, player_id)
+        if just_placed_bomb:
+            player.just_placed_bomb = tuple(just_placed_bomb)
+            player.pass_through = just_placed_bomb[1] * map.width + just_placed_bomb[0]
+        player.bomb_ready_at = now + cooldown
+        players[player_id] = player
+    bombs.clear()
+    for x, y, player_id, bomb_type, age in snapshot['bombs']:
+        bomb = Bomb(player_id, bomb_type, x, y)
+        bomb.placed_at = now - age
+        bombs.append(bomb)
+    explosions.clear()
+    for x, y, explosion_range, bomb_type, player_id, sectors, blocks_to_destroy, age in snapshot['explosions']:
+        # Bypass Explosion.__init__, the sectors were already applied to the saved map
+        explosion = Explosion.__new__(Explosion)
+        GameObject.__init__(explosion, x, y)
+        explosion.range = explosion_range
+        explosion.bomb_type = bomb_type
+        explosion.player_id = player_id
+        explosion.sectors = sectors
+        explosion.blocks_to_destroy = [tuple(block) for block in blocks_to_destroy]
+        explosion.start_time = now - age
+        explosions.append(explosion)
+
+# Spawn anchors: the four corners first (keeps the classic two-player layout),
+# then the edge midpoints, then the quarter points for bigger matches
+def spawn_anchors(width, height):
+    return [
+        (1, 1), (width - 2, height - 2), (width - 2, 1), (1, height - 2),
+        (width // 2, 1), (width // 2, height - 2), (1, height // 2), (width - 2, height // 2),
+        (width // 4, height // 4), (3 * width // 4, 3 * height // 4),
+        (3 * width // 4, height // 4), (width // 4, 3 * height // 4),
+    ]
+
+# Classic layout: solid border, pillars on even cells, random breakable blocks
+def generate_map(width, height, seed=0):
+    rng = random.Random(seed)
+    matrix = []
+    for y in range(height):
+        row = []
+        for x in range(width):
+            if x in (0, width - 1) or y in (0, height - 1) or (x % 2 == 0 and y % 2 == 0):
+                row.append(1)
+            elif rng.random() < BREAKABLE_DENSITY:
+                row.append(2)
+            else:
+                row.append(0)
+        matrix.append(row)
+    # Keep every spawn and its neighbours free so nobody starts boxed in
+    for (x, y) in spawn_anchors(width, height):
+        for (cx, cy) in ((x, y), (x + 1, y), (x - 1, y), (x, y + 1), (x, y - 1)):
+            if matrix[cy][cx] == 2:
+                matrix[cy][cx] = 0
+    return matrix
+
+def find_spawn_points(matrix):
+    # Snap each anchor to the nearest free cell of the map
+    height, width = len(matrix), len(matrix[0])
+    spawn_points = []
+    for (ax, ay) in spawn_anchors(width, height):
+        for radius in range(max(width, height)):
+            free = [
+                (x, y)
+                for y in range(max(ay - radius, 0), min(ay + radius + 1, height))
+                for x in range(max(ax - radius, 0), min(ax + radius + 1, width))
+                if matrix[y][x] == 0 and (x, y) not in spawn_points
+            ]
+            if free:
+                spawn_points.append(min(free, key=lambda p: abs(p[0] - ax) + abs(p[1] - ay)))
+                break
+    return spawn_points
 
 # Enum for movement types
 class MovementType(Enum):
@@ -74,7 +221,7 @@ class GameObject:
         self.pixel_y = round(self.y * TILE_SIZE, PRECISION) + HUD_HEIGHT
 
 class GameMap(GameObject):
-    def __init__(self, map_number=0):
+    def __init__(self, map_number=0, width=GRID_WIDTH, height=GRID_HEIGHT):
         super().__init__(0, 0)  # Initialize at grid origin
         self.maps = [
             # Map 1
@@ -120,21 +267,55 @@ class GameMap(GameObject):
                 [1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1]
             ]
         ]
+        if (width, height) != (len(self.maps[0][0]), len(self.maps[0])):
+            # Larger (or smaller) grids get generated maps instead of the built-in ones
+            self.maps = [generate_map(width, height, seed) for seed in range(len(self.maps))]
         self.map_number = map_number % len(self.maps)
         self.matrix = self.maps[self.map_number]
         self.width = len(self.matrix[0])
         self.height = len(self.matrix)
+        self.spawn_points = find_spawn_points(self.matrix)
+        self.revision = 0  # Bumped whenever the whole matrix is replaced
+        self.track_changes = False  # Only whoever drains take_changes() (the server) turns this on
+        self.changes = []  # (x, y, value) written since the last take_changes(), while tracking
+        self.rebuild_walkability()
+
+    def take_changes(self):
+        # Cells written since the last call, for delta snapshots
+        changes, self.changes = self.changes, []
+        return changes
+
+    def rebuild_walkability(self):
+        # One byte per cell (row-major), 1 when the cell blocks movement
+        self.blocked = bytearray(
+            value in BLOCKING_CELLS for row in self.matrix for value in row
+        )
+
+    def set_cell(self, grid_x, grid_y, value):
+        # Every map change goes through here so the walkability mask stays in sync
+        self.matrix[grid_y][grid_x] = value
+        self.blocked[grid_y * self.width + grid_x] = value in BLOCKING_CELLS
+        if self.track_changes:
+            self.changes.append((grid_x, grid_y, value))
+
+    def can_enter(self, grid_x, grid_y, pass_through=-1):
+        # Collision fast path: bounds check plus one mask lookup. pass_through is the
+        # cell index of the player's own just-placed bomb, which it may still leave
+        if 0 <= grid_y < self.height and 0 <= grid_x < self.width:
+            index = grid_y * self.width + grid_x
+            return not self.blocked[index] or index == pass_through
+        return False  # Out of bounds is considered an obstacle
 
     def next_map(self):
         self.map_number = (self.map_number + 1) % len(self.maps)
         self.return_map_to_original_state()
 
     def is_position_walkable(self, x, y, player):
-        return not self.is_obstacle(x,y, player)
+        return self.can_enter(x, y, player.pass_through)
 
     def is_unbreakable_obstacle(self, grid_x, grid_y):
         if 0 <= grid_y < self.height and 0 <= grid_x < self.width:
-            return self.matrix[grid_y][grid_x] in [1,-2]
+            return self.matrix[grid_y][grid_x] in (1, -2)
         return False
 
     def is_breakable_obstacle(self, grid_x, grid_y):
@@ -143,21 +324,14 @@ class GameMap(GameObject):
         return False
 
     def is_obstacle(self, grid_x, grid_y, player):
-        if 0 <= grid_y < self.height and 0 <= grid_x < self.width:
-            if player.just_placed_bomb is not None:
-                if self.matrix[grid_y][grid_x] == 3:
-                    print("é bomba")
-                    if (player.x <= player.just_placed_bomb[0] + 1 and
-                        player.x >= player.just_placed_bomb[0] - 1 and
-                        player.y <= player.just_placed_bomb[1] + 1 and
-                        player.y >= player.just_placed_bomb[1] - 1):
-                        print("permitido")
-                        return False
-            return self.matrix[grid_y][grid_x] in [1, 2, 3]
-        return True  # Out of bounds is considered an obstacle
+        return not self.can_enter(grid_x, grid_y, player.pass_through)
 
     def return_map_to_original_state(self):
         self.matrix = copy.deepcopy(self.maps[self.map_number])
+        self.spawn_points = find_spawn_points(self.matrix)
+        self.revision += 1
+        self.changes.clear()
+        self.rebuild_walkability()
 
 class Bomb(GameObject):
     def __init__(self, player_id, bomb_type, x, y):
@@ -177,42 +351,52 @@ class Bomb(GameObject):
     def explode(self):
         self.is_exploded = True
         # Remove the bomb from the map
-        map.matrix[int(self.y)][int(self.x)] = 0  # Bomb removed from the grid
+        map.set_cell(int(self.x), int(self.y), 0)  # Bomb removed from the grid
         
         # Remove bomb from the global bombs list and decrement the player's placed bomb count
         bombs.remove(self)
         placed_bombs[self.player_id] -= 1  # Decrement the count of placed bombs
         
         # Trigger the explosion, affecting the grid
-        self.explosion = Explosion(self.x, self.y, self.explosion_range, self.bomb_type)
+        self.explosion = Explosion(self.x, self.y, self.explosion_range, self.bomb_type, self.player_id)
         explosions.append(self.explosion)  # Add the explosion to the global list
 
         self.check_explosion_destruction()
 
     def check_explosion_destruction(self):
         # Check if the explosion affects any players or breakable blocks
-        for sector in self.explosion.sectors:  # Only check sectors of its own explosion
-            grid_x, grid_y = int(sector[0]), int(sector[1])
-
-            # Check if any player is hit
-            for i, player in enumerate(players):
-                if int(player.x) == grid_x and int(player.y) == grid_y:
-                    lives[i] -= 1
-                    print(f"Player {i+1} hit! Lives left: {lives[i]}")
-                    if lives[i] == 0:
-                        print(f"Player {i+1} has lost all lives. Game over!")
-                        reset_game()
-                    reset_round()
+        sectors = {(int(sector[0]), int(sector[1])) for sector in self.explosion.sectors}  # Only its own explosion
 
+        # Check if any player is hit (one pass over the players, not one per sector)
+        hit_players = [
+            player for player in players.values()
+            if player.is_alive() and (player.fx // FP_ONE, player.fy // FP_ONE) in sectors
+        ]
+        if hit_players:
+            in_round = alive_players()
+            for player in hit_players:
+                lives[player.player_id] -= 1
+                print(f"Player {player.player_id + 1} hit! Lives left: {lives[player.player_id]}")
+            left = alive_players()
+            # A match needs MIN_PLAYERS to be won; a lone player only loses the round until it runs out of lives
+            if left == 0 or (in_round >= MIN_PLAYERS and left <= 1):
+                print("Only one player left standing. Game over!" if left else "No players left standing. Game over!")
+                reset_game()
+            else:
+                reset_round()
+            return
+
+        for (grid_x, grid_y) in sectors:
             # Check if there is a breakable block in the sector
-            if map.matrix[grid_y][grid_x] in [-2,2]:  # Breakable block (now back to matrix[y][x] access)
-                map.matrix[grid_y][grid_x] = 0  # Destroy the block
+            if map.matrix[grid_y][grid_x] in (-2, 2):  # Breakable block (now back to matrix[y][x] access)
+                map.set_cell(grid_x, grid_y, 0)  # Destroy the block
 
 class Explosion(GameObject):
-    def __init__(self, x, y, explosion_range, bomb_type):
+    def __init__(self, x, y, explosion_range, bomb_type, player_id):
         super().__init__(x, y)  # Inicializa a posição da explosão
         self.range = explosion_range
         self.bomb_type = bomb_type
+        self.player_id = player_id
         self.blocks_to_destroy = []  # Lista para armazenar blocos a serem destruídos
         self.sectors = self.calculate_sectors()
         self.start_time = time.time()
@@ -232,7 +416,7 @@ class Explosion(GameObject):
 
                 # Verifica se há um bloco quebrável
                 if map.is_breakable_obstacle(grid_x, grid_y):
-                    map.matrix[grid_y][grid_x] = -2
+                    map.set_cell(grid_x, grid_y, -2)
                     #sectors.append([grid_x, grid_y])  # Adiciona o bloco à lista de setores afetados
                     self.blocks_to_destroy.append((grid_x, grid_y))  # Marca o bloco para destruição
                     break  # Para a explosão após destruir o bloco
@@ -253,7 +437,7 @@ class Explosion(GameObject):
         if time.time() - self.start_time > 0.4:  # A explosão dura 1 segundo
             # Destrói os blocos após a explosão terminar
             for (grid_x, grid_y) in self.blocks_to_destroy:
-                map.matrix[grid_y][grid_x] = 0  # Destrói o bloco marcado
+                map.set_cell(grid_x, grid_y, 0)  # Destrói o bloco marcado
             explosions.remove(self)
 
     def is_player_in_explosion(self, player):
@@ -264,73 +448,96 @@ class Explosion(GameObject):
         return False
 
 class Player(GameObject):
+    # Positions are fixed-point integers (fx, fy in 1/FP_ONE tiles) so movement
+    # and grid alignment checks are exact without rounding floats every step
     def __init__(self, x, y, bomb_type, player_id):
-        super().__init__(x, y)
-        self.speed = 0.05  # Movement speed in tile units per update
+        self.x = x
+        self.y = y
+        self.speed = round(0.05 * FP_ONE)  # Movement speed in sub-tile units per update
         self.bomb_type = bomb_type  # Type of bombs the player can place
         self.player_id = player_id  # Player ID
-        self.can_place_bomb = True
+        self.bomb_ready_at = 0  # Timestamp when the player can place the next bomb
         self.just_placed_bomb = None
+        self.pass_through = -1  # Cell index of just_placed_bomb, -1 when there is none
+
+    @property
+    def x(self):
+        return self.fx / FP_ONE
+
+    @x.setter
+    def x(self, value):
+        self.fx = round(value * FP_ONE)
+
+    @property
+    def y(self):
+        return self.fy / FP_ONE
+
+    @y.setter
+    def y(self, value):
+        self.fy = round(value * FP_ONE)
+
+    @property
+    def pixel_x(self):
+        return self.fx * TILE_SIZE / FP_ONE
+
+    @property
+    def pixel_y(self):
+        return self.fy * TILE_SIZE / FP_ONE + HUD_HEIGHT
+
+    def update_pixel_position(self):
+        pass  # Pixel position is derived from the fixed-point position
+
+    def is_alive(self):
+        return lives[self.player_id] > 0
 
     def place_bomb(self):
         # Place bomb at the nearest grid position (round the player's current position)
-        if placed_bombs[self.player_id] < 3 and map.matrix[int(self.y)][int(self.x)] != 3 and self.can_place_bomb:
+        if placed_bombs[self.player_id] < 3 and map.matrix[self.fy // FP_ONE][self.fx // FP_ONE] != 3 and time.time() >= self.bomb_ready_at:
             x_bomb = round(self.x)
             y_bomb = round(self.y)
-            #print("place bomb at ", x_bomb, y_bomb)
             bomb = Bomb(self.player_id, self.bomb_type, x_bomb, y_bomb)
             bombs.append(bomb)  # Add the bomb to the global bombs list
-            
+
             # Permite o player atravessar a bomba temporariamente
             self.just_placed_bomb = (x_bomb, y_bomb)
-            print("just placed bomb value: ", self.just_placed_bomb)
-            
-            map.matrix[y_bomb][x_bomb] = 3  # Mark the grid as having a bomb
-            self.can_place_bomb = False
-            placed_bombs[self.player_id] += 1  # Increment the count of placed bombs
-            # Reativa a capacidade de colocar bomba após 3 segundos (por exemplo)
-            threading.Timer(3, self.reactivate_bomb_placement).start()
+            self.pass_through = y_bomb * map.width + x_bomb
 
-    def reactivate_bomb_placement(self):
-        self.can_place_bomb = True
+            map.set_cell(x_bomb, y_bomb, 3)  # Mark the grid as having a bomb
+            placed_bombs[self.player_id] += 1  # Increment the count of placed bombs
+            # Reativa a capacidade de colocar bomba após 3 segundos (sem uma thread por bomba)
+            self.bomb_ready_at = time.time() + 3
 
     def move(self, controller):
-        new_x, new_y = self.x, self.y
+        fx, fy, speed = self.fx, self.fy, self.speed
         if self.just_placed_bomb is not None:
-            if (self.x >= self.just_placed_bomb[0] + 1 or self.x <= self.just_placed_bomb[0] - 1 or
-                    self.y >= self.just_placed_bomb[1] + 1 or self.y <= self.just_placed_bomb[1] - 1):
+            # Leave the pass-through once the player is a full tile away from its bomb
+            if (abs(fx - self.just_placed_bomb[0] * FP_ONE) >= FP_ONE or
+                    abs(fy - self.just_placed_bomb[1] * FP_ONE) >= FP_ONE):
                 self.just_placed_bomb = None
+                self.pass_through = -1
+
+        # Handle movement using GameController input. Vertical moves need the player
+        # aligned on a column, horizontal moves aligned on a row
+        if controller['up'] and fx % FP_ONE == 0:
+            if map.can_enter(fx // FP_ONE, (fy - speed) // FP_ONE, self.pass_through):
+                fy -= speed
 
-        # Handle movement using GameController input
-        if controller['up']:
-            new_y = self.y - self.speed
-            if map.is_position_walkable(int(self.x), int(new_y), self):
-                if int(self.x) == self.x:
-                    self.y = round(new_y, PRECISION)
-
-        if controller['down']:
-            new_y = self.y + self.speed
-            if map.is_position_walkable(int(self.x), ceil(new_y), self):
-                if int(self.x) == self.x:
-                    self.y = round(new_y, PRECISION)
-
-        if controller['left']:
-            new_x = self.x - self.speed
-            if map.is_position_walkable(int(new_x), int(self.y), self):
-                if int(self.y) == self.y:
-                    self.x = round(new_x, PRECISION)
-
-        if controller['right']:
-            new_x = self.x + self.speed
-            if map.is_position_walkable(ceil(new_x), int(self.y), self):
-                if int(self.y) == self.y:
-                    self.x = round(new_x, PRECISION)
+        if controller['down'] and fx % FP_ONE == 0:
+            if map.can_enter(fx // FP_ONE, -(-(fy + speed) // FP_ONE), self.pass_through):
+                fy += speed
+
+        if controller['left'] and fy % FP_ONE == 0:
+            if map.can_enter((fx - speed) // FP_ONE, fy // FP_ONE, self.pass_through):
+                fx -= speed
+
+        if controller['right'] and fy % FP_ONE == 0:
+            if map.can_enter(-(-(fx + speed) // FP_ONE), fy // FP_ONE, self.pass_through):
+                fx += speed
 
         #if self.check_collision_with_explosions:
         #    reset_round()    # Not working
 
-        # Update player position after calculating new positions
-        self.update_pixel_position()
+        self.fx, self.fy = fx, fy
 
     def check_collision_with_explosions(self):
         for explosion in explosions:
@@ -351,5 +558,6 @@ reset_game()
 # Export necessary variables and classes
 __all__ = [
     'GameController', 'GameMap', 'Player', 'bombs', 'explosions', 'players',
-    'placed_bombs', 'lives', 'reset_game', 'map'
+    'placed_bombs', 'lives', 'reset_game', 'map', 'add_player', 'remove_player',
+    'free_player_slot', 'update', 'snapshot', 'snapshot_mismatch', 'restore'
 ]
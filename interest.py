@@ -0,0 +1,116 @@
+import itertools
+import json
+
+# Area-of-interest filtering for player snapshots.
+#
+# The room is split into chunk_size x chunk_size chunks. Every tick the
+# entities are partitioned by chunk and each chunk's share is encoded once,
+# as JSON fragments; a player's snapshot is the concatenation of the
+# fragments of the chunks around it (view_radius chunks in every direction),
+# so the work and the size per player do not grow with the map. Map cells
+# go per chunk, only when the player has not seen the chunk's current
+# version yet (it entered the view or one of its cells changed), and an
+# encoded chunk is cached until it changes. Outside its view a player only
+# gets everyone's coarse (whole cell) position, the lives and the timer.
+#
+#   {"type": "view", "tick", "revision", "width", "height", "far_players", "lives",
+#    "timestamp", "server_time", "chunks": {id: [x0, y0, rows]}, "players", "bombs", "explosions"}
+
+
+class InterestGrid:
+    def __init__(self, chunk_size, view_radius):
+        self.chunk_size = chunk_size
+        self.view_radius = view_radius
+        self.columns = self.rows = 0
+        self.revision = None  # map.revision the chunks were laid out for
+        self.version_counter = itertools.count(1)
+        self.versions = []  # Per chunk, replaced by a new number whenever one of its cells changes
+        self.encoded_cells = {}  # chunk -> (version, JSON fragment)
+        self.matrix = []
+        self.header = ''
+        self.players = {}  # chunk -> JSON fragments of this tick
+        self.bombs = {}
+        self.explosions = {}
+        self.views = {}  # Encoded snapshots of this tick, shared by players with the same view and needs
+
+    def update(self, game_map, changes):
+        # Follow the map: relayout on a new map, otherwise bump the chunks that changed
+        self.matrix = game_map.matrix
+        if game_map.revision != self.revision:
+            self.revision = game_map.revision
+            self.columns = -(-game_map.width // self.chunk_size)
+            self.rows = -(-game_map.height // self.chunk_size)
+            self.versions = [next(self.version_counter) for _ in range(self.columns * self.rows)]
+            self.encoded_cells.clear()
+            return
+        for x, y, _ in changes:
+            self.versions[self.chunk(x, y)] = next(self.version_counter)
+
+    def chunk(self, x, y):
+        size = self.chunk_size
+        column = min(max(int(x) // size, 0), self.columns - 1)
+        row = min(max(int(y) // size, 0), self.rows - 1)
+        return row * self.columns + column
+
+    def begin_tick(self, header, entities):
+        # Partition this tick's serialized entities (see server.serialize_entities) by chunk
+        self.header = json.dumps(header)[1:-1]
+        self.views = {}
+        self.players = players = {}
+        for player_id, (x, y) in entities['players'].items():
+            players.setdefault(self.chunk(x, y), []).append(f'"{player_id}": {json.dumps([x, y])}')
+        self.bombs = bombs = {}
+        for bomb in entities['bombs']:
+            bombs.setdefault(self.chunk(bomb['x'], bomb['y']), []).append(json.dumps(bomb))
+        self.explosions = explosions = {}
+        for explosion in entities['explosions']:
+            # An explosion crossing chunks is split, each chunk gets the sectors inside it
+            parts = {}
+            for sector in explosion['sectors']:
+                parts.setdefault(self.chunk(*sector), []).append(sector)
+            for chunk, sectors in parts.items():
+                explosions.setdefault(chunk, []).append(json.dumps({**explosion, 'sectors': sectors}))
+
+    def view(self, x, y):
+        # Chunks within view_radius of the chunk holding (x, y)
+        center = self.chunk(x, y)
+        column, row = center % self.columns, center // self.columns
+        radius = self.view_radius
+        return tuple(
+            r * self.columns + c
+            for r in range(max(row - radius, 0), min(row + radius + 1, self.rows))
+            for c in range(max(column - radius, 0), min(column + radius + 1, self.columns))
+        )
+
+    def snapshot(self, x, y, known):
+        # UTF-8 encoded snapshot for a player at (x, y), to send as a text frame; known maps
+        # chunk -> version the player already has and is updated with what this snapshot sends
+        chunks = self.view(x, y)
+        versions = self.versions
+        stale = tuple(chunk for chunk in chunks if known.get(chunk) != versions[chunk])
+        message = self.views.get((chunks, stale))
+        if message is None:
+            message = self.views[(chunks, stale)] = (
+                '{"type": "view", ' + self.header
+                + ', "chunks": {' + ', '.join(self._cells(chunk) for chunk in stale)
+                + '}, "players": {' + ', '.join(self._gather(self.players, chunks))
+                + '}, "bombs": [' + ', '.join(self._gather(self.bombs, chunks))
+                + '], "explosions": [' + ', '.join(self._gather(self.explosions, chunks)) + ']}'
+            ).encode()
+        for chunk in stale:
+            known[chunk] = versions[chunk]
+        return message
+
+    def _gather(self, partition, chunks):
+        for chunk in chunks:
+            yield from partition.get(chunk, ())
+
+    def _cells(self, chunk):
+        version = self.versions[chunk]
+        cached = self.encoded_cells.get(chunk)
+        if cached is None or cached[0] != version:
+            size = self.chunk_size
+            x0, y0 = chunk % self.columns * size, chunk // self.columns * size
+            rows = [row[x0:x0 + size] for row in self.matrix[y0:y0 + size]]
+            cached = self.encoded_cells[chunk] = (version, f'"{chunk}": {json.dumps([x0, y0, rows])}')
+        return cached[1]
@@ -0,0 +1,258 @@
+import argparse
+import asyncio
+import csv
+import heapq
+import itertools
+import random
+import time
+
+import websockets
+
+try:
+    import tomllib
+except ModuleNotFoundError:
+    import tomli as tomllib
+
+from settings import SERVER_PORT
+
+# Network impairment proxy for local testing. Sits between client.py and
+# server.py and delays, throttles, reorders, drops or stalls every websocket
+# message, separately for each direction ("up" is client -> server, "down" is
+# server -> client). Profiles come from a preset or a scenario script that
+# switches profiles over time, and every message can be logged with timing.
+#
+#   python3 server.py
+#   python3 netem_proxy.py --preset 150ms-2pct --log netem.csv
+#   python3 client.py --url ws://127.0.0.1:9765
+#
+# Scenario scripts are TOML files with a list of phases; each phase lasts
+# `duration` seconds and sets `preset` for both directions and/or `up`/`down`
+# (a preset name or a table of profile fields):
+#
+#   loop = true
+#   [[phase]]
+#   duration = 20
+#   preset = "wifi"
+#   [[phase]]
+#   duration = 5
+#   up = "wifi"
+#   down = { latency_ms = 300, jitter_ms = 50, loss = 0.05 }
+#
+# Websockets run over TCP, so real packet loss shows up as a stall (the
+# retransmission delays this message and everything queued behind it). That
+# is the default loss_mode; "drop" discards the message instead.
+
+# One-way values: '150ms-2pct' on both directions gives a 150 ms round trip
+PRESETS = {
+    'none': {},
+    'lan': {'latency_ms': 1, 'jitter_ms': 0.5},
+    'wifi': {'latency_ms': 8, 'jitter_ms': 6, 'loss': 0.002},
+    'dsl': {'latency_ms': 25, 'jitter_ms': 5, 'bandwidth_kbps': 1000},
+    'mobile': {'latency_ms': 50, 'jitter_ms': 25, 'loss': 0.01, 'reorder': 0.01, 'bandwidth_kbps': 2000},
+    '150ms-2pct': {'latency_ms': 75, 'jitter_ms': 10, 'loss': 0.02},
+    'congested': {'latency_ms': 120, 'jitter_ms': 60, 'loss': 0.03, 'bandwidth_kbps': 256},
+}
+
+
+class LinkProfile:
+    __slots__ = ('latency_ms', 'jitter_ms', 'loss', 'loss_mode', 'stall_ms', 'bandwidth_kbps', 'reorder')
+
+    def __init__(self, latency_ms=0, jitter_ms=0, loss=0, loss_mode='stall', stall_ms=200,
+                 bandwidth_kbps=0, reorder=0):
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+        self.loss = loss  # Probability of losing a message
+        self.loss_mode = loss_mode  # 'stall' (TCP retransmit) or 'drop'
+        self.stall_ms = stall_ms  # How long a lost message holds up the link
+        self.bandwidth_kbps = bandwidth_kbps  # 0 means unlimited
+        self.reorder = reorder  # Probability a message may overtake the ones queued before it
+
+    @classmethod
+    def parse(cls, spec):
+        # A preset name or a table of fields
+        if isinstance(spec, str):
+            if spec not in PRESETS:
+                raise ValueError(f"Unknown preset '{spec}', choose from: {', '.join(PRESETS)}")
+            return cls(**PRESETS[spec])
+        return cls(**spec)
+
+
+class Link:
+    # One direction of one proxied connection
+    def __init__(self, name, conn_id, profile, rng, log):
+        self.name = name
+        self.conn_id = conn_id
+        self.profile = profile
+        self.rng = rng
+        self.log = log
+        self.queue = []  # Heap of (deliver_at, order, received_at, message, action)
+        self.order = itertools.count()
+        self.wakeup = asyncio.Event()
+        self.link_free_at = 0.0  # When the (throttled) link finishes sending what it already has
+        self.last_deliver_at = 0.0  # Keeps FIFO order unless a message is reordered
+
+    def push(self, message):
+        profile = self.profile
+        now = time.monotonic()
+        size = len(message)
+        action = 'deliver'
+
+        if profile.loss and self.rng.random() < profile.loss:
+            if profile.loss_mode == 'drop':
+                self.record(now, now, size, 'drop')
+                return
+            action = 'stall'
+
+        # Serialization delay on a capped link
+        send_done = now
+        if profile.bandwidth_kbps:
+            send_done = max(now, self.link_free_at) + size * 8 / (profile.bandwidth_kbps * 1000)
+            self.link_free_at = send_done
+
+        delay = profile.latency_ms + self.rng.uniform(-profile.jitter_ms, profile.jitter_ms)
+        if action == 'stall':
+            delay += profile.stall_ms
+        deliver_at = send_done + max(delay, 0) / 1000
+
+        if profile.reorder and self.rng.random() < profile.reorder:
+            action = 'reorder' if action == 'deliver' else action
+        else:
+            # In order: never before the previous message (a stall holds up everything behind it)
+            deliver_at = max(deliver_at, self.last_deliver_at)
+        self.last_deliver_at = max(self.last_deliver_at, deliver_at)
+
+        heapq.heappush(self.queue, (deliver_at, next(self.order), now, message, action))
+        self.wakeup.set()
+
+    async def pump(self, websocket):
+        # Send queued messages to `websocket` when they are due
+        while True:
+            if not self.queue:
+                self.wakeup.clear()
+                await self.wakeup.wait()
+                continue
+            deliver_at = self.queue[0][0]
+            wait = deliver_at - time.monotonic()
+            if wait > 0:
+                self.wakeup.clear()
+                try:
+                    # Wake up early if a reordered message lands in front
+                    await asyncio.wait_for(self.wakeup.wait(), wait)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+            _, _, received_at, message, action = heapq.heappop(self.queue)
+            try:
+                await websocket.send(message)
+            except websockets.exceptions.ConnectionClosed:
+                return
+            self.record(received_at, time.monotonic(), len(message), action)
+
+    def record(self, received_at, sent_at, size, action):
+        if self.log is not None:
+            self.log.writerow([f'{received_at:.6f}', self.conn_id, self.name, size, action,
+                               f'{(sent_at - received_at) * 1000:.3f}'])
+
+
+class Proxy:
+    def __init__(self, upstream, up, down, script, seed, log):
+        self.upstream = upstream.rstrip('/')
+        self.up = up
+        self.down = down
+        self.script = script
+        self.rng = random.Random(seed)
+        self.log = log
+        self.links = []
+        self.conn_ids = itertools.count(1)
+
+    async def handle(self, client):
+        conn_id = next(self.conn_ids)
+        path = client.request.path
+        try:
+            async with websockets.connect(self.upstream + path) as server:
+                up = Link('up', conn_id, self.up, self.rng, self.log)
+                down = Link('down', conn_id, self.down, self.rng, self.log)
+                self.links += [up, down]
+                print(f"[{conn_id}] proxying {path} -> {self.upstream}")
+                tasks = [
+                    asyncio.create_task(self.forward(client, up)),
+                    asyncio.create_task(self.forward(server, down)),
+                    asyncio.create_task(up.pump(server)),
+                    asyncio.create_task(down.pump(client)),
+                ]
+                try:
+                    # Either side closing (or failing) ends the proxied connection
+                    await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+                finally:
+                    for task in tasks:
+                        task.cancel()
+                    self.links.remove(up)
+                    self.links.remove(down)
+        except (OSError, websockets.exceptions.WebSocketException) as e:
+            print(f"[{conn_id}] upstream error: {e}")
+        print(f"[{conn_id}] closed")
+
+    async def forward(self, source, link):
+        try:
+            async for message in source:
+                link.push(message)
+        except websockets.exceptions.ConnectionClosed:
+            pass
+
+    def set_profiles(self, up, down):
+        self.up, self.down = up, down
+        for link in self.links:
+            link.profile = up if link.name == 'up' else down
+
+    async def run_script(self):
+        phases = self.script['phase']
+        while True:
+            for phase in phases:
+                up = LinkProfile.parse(phase.get('up', phase.get('preset', 'none')))
+                down = LinkProfile.parse(phase.get('down', phase.get('preset', 'none')))
+                self.set_profiles(up, down)
+                print(f"Phase: {phase}")
+                await asyncio.sleep(phase['duration'])
+            if not self.script.get('loop', False):
+                return
+
+
+async def main():
+    parser = argparse.ArgumentParser(description='Latency/jitter/loss proxy for Overblocked')
+    parser.add_argument('--listen', type=int, default=SERVER_PORT + 1000, help='local port the client connects to')
+    parser.add_argument('--upstream', default=f'ws://127.0.0.1:{SERVER_PORT}', help='game server URL')
+    parser.add_argument('--preset', default='none', choices=PRESETS, help='profile for both directions')
+    parser.add_argument('--up', choices=PRESETS, help='client -> server profile (overrides --preset)')
+    parser.add_argument('--down', choices=PRESETS, help='server -> client profile (overrides --preset)')
+    parser.add_argument('--script', help='TOML scenario with timed phases')
+    parser.add_argument('--seed', type=int, help='random seed, for reproducible runs')
+    parser.add_argument('--log', help='CSV file with one row per message')
+    args = parser.parse_args()
+
+    script = None
+    if args.script:
+        with open(args.script, 'rb') as f:
+            script = tomllib.load(f)
+
+    # Line buffered: every row reaches the file as it is written, a kill or a crash keeps the log
+    log_file = open(args.log, 'w', newline='', buffering=1) if args.log else None
+    log = None
+    try:
+        if log_file:
+            log = csv.writer(log_file)
+            log.writerow(['received_at', 'conn', 'direction', 'bytes', 'action', 'delay_ms'])
+
+        proxy = Proxy(args.upstream, LinkProfile.parse(args.up or args.preset),
+                      LinkProfile.parse(args.down or args.preset), script, args.seed, log)
+        async with websockets.serve(proxy.handle, '127.0.0.1', args.listen):
+            print(f"Proxy on ws://127.0.0.1:{args.listen} -> {args.upstream}")
+            if script:
+                await proxy.run_script()
+            await asyncio.Future()
+    finally:
+        if log_file:
+            log_file.close()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,83 @@
+import json
+import struct
+
+# Server -> client snapshots are JSON objects whose first key is "type":
+#   welcome   {"type", "player_id", "session"}  sent once when a player joins or reattaches
+#   keyframe  {"type", "tick", "map", ...entities}  full state (spectators)
+#   delta     {"type", "tick", "base", "cells", ...entities}  map cells changed since tick `base` (spectators)
+#   view      player snapshot limited to the chunks around the player, see interest.py
+#   pong      {"type", "t0", "t1", "t2"}  answer to a client ping, see timesync.py
+#   ping      {"type", "seq"}  RTT probe, answered with {"type": "pong", "seq"} (timesync.RttProbe)
+# In keyframes and deltas the entities (players, bombs, explosions, lives, timestamp,
+# server_time) are sent in full every tick. server_time and bomb placed_at are on the server clock.
+#
+# Client -> server text messages: {"type": "ping", "t0"} (see timesync.py), the echo
+# of an RTT probe, or the legacy {"controller": {...}} input.
+
+KEYFRAME_PREFIX = '{"type": "keyframe"'
+PING_PREFIX = '{"type": "ping"'
+
+
+def is_keyframe(message):
+    # Cheap check on an encoded message, without decoding it
+    return message.startswith(KEYFRAME_PREFIX)
+
+
+def is_ping(message):
+    return message.startswith(PING_PREFIX)
+
+
+def decode_message(message):
+    # A text message decoded, None if it is not a JSON object
+    try:
+        message = json.loads(message)
+    except ValueError:
+        return None
+    return message if isinstance(message, dict) else None
+
+
+# Client -> server input packets.
+#
+# The client only sends its key state when it changes (plus a low-rate
+# keepalive), as a binary message: <seq:u16><keys:u8>, network byte order.
+# The server keeps the last key state per player and applies it every tick.
+
+INPUT_PACKET = struct.Struct('!HB')
+
+UP = 1
+DOWN = 2
+LEFT = 4
+RIGHT = 8
+PLACE_BOMB = 16
+
+KEY_BITS = {'up': UP, 'down': DOWN, 'left': LEFT, 'right': RIGHT, 'place_bomb': PLACE_BOMB}
+
+# One read-only controller mapping per key state, so applying inputs every tick allocates nothing
+CONTROLLERS = [
+    {name: bool(keys & bit) for name, bit in KEY_BITS.items()}
+    for keys in range(32)
+]
+
+
+def pack_input(seq, keys):
+    return INPUT_PACKET.pack(seq & 0xFFFF, keys)
+
+
+def unpack_input(data):
+    # (seq, keys) from a packet, raises struct.error on a malformed one
+    seq, keys = INPUT_PACKET.unpack(data)
+    return seq, keys & 0x1F
+
+
+def keys_from_controller(controller):
+    # Key state from the legacy JSON controller dict
+    keys = 0
+    for name, bit in KEY_BITS.items():
+        if controller.get(name):
+            keys |= bit
+    return keys
+
+
+def is_newer(seq, last_seq):
+    # Sequence numbers wrap at 16 bits; anything up to half the range ahead is newer
+    return 0 < (seq - last_seq) & 0xFFFF < 0x8000
@@ -0,0 +1,246 @@
+import pygame
+import time
+
+from settings import data, TILE_SIZE, HUD_HEIGHT
+
+# Client-side rendering: sprites, colors and the draw functions.
+# The server and headless tools never import this module (no pygame there).
+
+# Load colors
+colors = data['colors']
+BACKGROUND_COLOR = tuple(colors['background_color'])
+GRID_COLOR = tuple(colors['grid_color'])
+BREAKABLE_COLOR = tuple(colors['breakable_color'])
+BREAKING_COLOR = tuple(colors['breaking_color'])
+BOMB_COLOR = tuple(colors['bomb_color'])
+OBSTACLE_COLOR = tuple(colors['obstacle_color'])
+PLAYER_COLOR = tuple(colors['player_color'])
+PLAYER_2_COLOR = tuple(colors['player_2_color'])
+HUD_COLOR = tuple(colors['hud_color'])
+PLAYER1_EXPLOSION_COLOR = tuple(colors['player1_explosion_color'])
+PLAYER2_EXPLOSION_COLOR = tuple(colors['player2_explosion_color'])
+
+tile_size = TILE_SIZE  # Drawn size of a tile, set by load_sprites
+
+
+def fit_tile_size(grid_size, display_size):
+    # Largest tile, up to TILE_SIZE, that fits the grid and the HUD on a display_size screen
+    # with some room left for the window decorations; big grids get smaller tiles
+    columns, rows = grid_size
+    width, height = display_size
+    if width <= 0 or height <= 0:
+        return TILE_SIZE  # Display size unknown
+    return max(min(TILE_SIZE, width * 9 // 10 // columns, (height * 9 // 10 - HUD_HEIGHT) // rows), 8)
+
+
+def scaled(size):
+    # A sprite size given for TILE_SIZE tiles, at the current tile_size
+    return tuple(max(round(n * tile_size / TILE_SIZE), 1) for n in size)
+
+
+def load_sprites(size=TILE_SIZE):
+    global tile_size
+    tile_size = size
+    global player1_animations, player2_animations, player1_idle_sprite, player2_idle_sprite, trunk_sprite, rock_sprite, mango_bomb_sprite, venom_bomb_sprite, mango_bomb_animation, venom_bomb_animation
+    global player_animations, bomb_animations
+
+    player1_animations = load_player1_animation_frames()
+    player2_animations = load_player2_animation_frames()
+    # Characters and bombs alternate between the two sprite sets by player ID
+    player_animations = [player1_animations, player2_animations]
+    player1_idle_sprite = pygame.image.load(
+        'assets/caco-idle.png').convert_alpha()
+    player2_idle_sprite = pygame.image.load(
+        'assets/cobra-idle.png').convert_alpha()
+    trunk_sprite = pygame.transform.scale(pygame.image.load('assets/trunk.png').convert_alpha(), (tile_size, tile_size))
+    rock_sprite = pygame.image.load('assets/rock.png').convert_alpha()
+    #mango_bomb_sprite = pygame.image.load(
+    #    'assets/mango-bomb.png').convert_alpha()
+    #mango_bomb_sprite = pygame.transform.scale(mango_bomb_sprite, (65, 65))
+    #venom_bomb_sprite = pygame.image.load(
+    #    'assets/venom-bomb.png').convert_alpha()
+    #venom_bomb_sprite = pygame.transform.scale(venom_bomb_sprite, (65, 65))
+
+    global bomb_start_times
+    bomb_start_times = {}
+    mango_bomb_animation = [pygame.transform.scale(pygame.image.load(f'./assets/bomb-mango-animation/{i}.png').convert_alpha(), scaled((60, 60))) for i in range(1, 6)]
+    venom_bomb_animation = [pygame.transform.scale(pygame.image.load(f'./assets/bomb-venom-animation/{i}.png').convert_alpha(), scaled((60, 60))) for i in range(1, 6)]
+    bomb_animations = [mango_bomb_animation, venom_bomb_animation]
+
+
+def update_animation_state(state) -> None:
+    """
+    Advance the walking animation of every player in the client GameState.
+    A player walks while its last two snapshots differ (the same step the
+    interpolation draws), so frames between snapshots keep the animation going;
+    players standing still go back to frame 0.
+    """
+    current_time = time.time()
+    for player in state.players:
+        if not player.present:
+            continue
+        dx = player.x - player.from_x
+        dy = player.y - player.from_y
+        if dx or dy:
+            player.is_moving = True
+            if (dx < 0 and dy < 0) or (dy < 0 and dx == 0):
+                player.direction = 'up'
+            elif (dx > 0 and dy > 0) or (dy > 0 and dx == 0):
+                player.direction = 'down'
+            elif (dx < 0):
+                player.direction = 'left'
+            elif (dx > 0):
+                player.direction = 'right'
+        else:
+            player.is_moving = False
+
+        if player.is_moving:
+            if current_time - player.last_update > 0.1:
+                frames = player_animations[player.player_id % len(player_animations)][player.direction]
+                player.frame = (player.frame + 1) % len(frames)
+                player.last_update = current_time
+        else:
+            player.frame = 0
+
+
+def load_backgrounds(screen_size):
+    # Scaled to the play area of a screen_size (width, height) window, below the HUD
+    width, height = screen_size
+    backgrounds = []
+    for name in ('mapa_neve_com_pedra', 'mapa_verde_com_pedra', 'mapa_areia_com_pedra'):
+        background = pygame.image.load(f'./assets/maps/{name}.png').convert()
+        backgrounds.append(pygame.transform.scale(background, (width, height - HUD_HEIGHT)))
+    return backgrounds
+
+
+def draw_background(screen, state, backgrounds):
+    # The background changes with the total lives left
+    screen.blit(backgrounds[sum(state.lives) % len(backgrounds)], (0, HUD_HEIGHT))
+
+
+def draw_game(screen, state):
+    draw_tiles(screen, state)
+    draw_bombs(screen, state)
+    draw_explosions(screen, state)
+    draw_players(screen, state)
+
+
+def draw_tiles(screen, state):
+    # Draw the map (only breakable and breaking blocks are drawn over the background)
+    for (col, row, cell_value) in state.block_cells:
+        if cell_value == 2:
+            screen.blit(trunk_sprite, (col * tile_size,
+                        row * tile_size + HUD_HEIGHT))
+        else:
+            pygame.draw.rect(screen, BREAKING_COLOR, (col * tile_size,
+                             row * tile_size + HUD_HEIGHT, tile_size, tile_size))
+
+
+def draw_bombs(screen, state):
+    # Draw bombs with animation
+    EXPLOSION_DURATION=3000
+    for bomb in state.active_bombs():
+        x = bomb.x
+        y = bomb.y
+        pixel_x = x * tile_size
+        pixel_y = y * tile_size + HUD_HEIGHT
+
+        # Calculate time elapsed since bomb was placed, on the server clock when we know it
+        if bomb.placed_at is not None and state.server_now is not None:
+            elapsed_time = max(int((state.server_now - bomb.placed_at) * 1000), 0)
+        else:
+            # Older server: count from when we first saw the bomb
+            if (x, y) not in bomb_start_times:
+                bomb_start_times[(x, y)] = pygame.time.get_ticks()
+            elapsed_time = pygame.time.get_ticks() - bomb_start_times[(x, y)]
+
+        # Determine the current frame of the animation based on elapsed time
+        frame_index = (elapsed_time // (EXPLOSION_DURATION // len(mango_bomb_animation))) % len(mango_bomb_animation)
+
+        # Choose the correct animation frames based on player ID (mango, venom, mango, ...)
+        current_frame = bomb_animations[bomb.player_id % len(bomb_animations)][frame_index]
+
+        # Draw the current frame of the bomb
+        screen.blit(current_frame, (pixel_x, pixel_y))
+
+        # Check if the bomb should explode (if elapsed time is greater than EXPLOSION_DURATION)
+        if elapsed_time > EXPLOSION_DURATION and (x, y) in bomb_start_times:
+            # Remove the bomb from the dictionary once it explodes to clean up
+            del bomb_start_times[(x, y)]
+            # Trigger explosion here (e.g., update game state or call explosion logic)
+
+
+def draw_explosions(screen, state):
+    # Draw explosions
+    explosion_colors = [PLAYER1_EXPLOSION_COLOR, PLAYER2_EXPLOSION_COLOR]
+    for explosion in state.active_explosions():
+        player_id = explosion.player_id
+        if player_id is not None:
+            color = explosion_colors[player_id % len(explosion_colors)]
+        else:
+            color = (255, 0, 0)  # Default color if the owner is unknown
+        for sector in explosion.sectors:
+            x, y = sector
+            pixel_x = x * tile_size
+            pixel_y = y * tile_size + HUD_HEIGHT
+            pygame.draw.rect(
+                screen, color, (pixel_x, pixel_y, tile_size, tile_size))
+
+
+def draw_players(screen, state):
+    # Draw players
+    for player in state.players:
+        if not player.present:
+            continue
+        pixel_x = player.draw_x * tile_size  # Interpolated position, see GameState.interpolate
+        pixel_y = player.draw_y * tile_size + HUD_HEIGHT
+
+        sprite = player_animations[player.player_id % len(player_animations)][player.direction][player.frame]
+
+        sprite_width, sprite_height = sprite.get_size()
+        centralized_x = pixel_x + (tile_size - sprite_width) // 2
+        centralized_y = pixel_y  # A altura já é a mesma, então não precisa ajustar
+        # Use the player sprite at the calculated pixel coordinates
+        screen.blit(sprite, (centralized_x, centralized_y))
+
+
+def draw_hud(screen, timer, lives):
+    # Create a black background for the HUD
+    screen_width = screen.get_width()
+    pygame.draw.rect(screen, HUD_COLOR, (0, 0, screen_width, HUD_HEIGHT))
+    font = pygame.font.SysFont(None, 36)
+    # P1 and P2 are always shown, other slots only while they have lives
+    shown = [player_id for player_id, player_lives in enumerate(lives) if player_id < 2 or player_lives > 0]
+    label = "P{} Lives: {}" if len(shown) <= 2 else "P{}: {}"
+    step = 150 if len(shown) <= 2 else 80
+    left, right = shown[:(len(shown) + 1) // 2], shown[(len(shown) + 1) // 2:]
+    # First half of the players on the left corner, second half on the right corner
+    for i, player_id in enumerate(left):
+        text = font.render(label.format(player_id + 1, lives[player_id]), True, (255, 255, 255))
+        screen.blit(text, (10 + i * step, 10))
+    for i, player_id in enumerate(reversed(right)):
+        text = font.render(label.format(player_id + 1, lives[player_id]), True, (255, 255, 255))
+        screen.blit(text, (screen_width - step - i * step, 10))
+    # Timer in the middle
+    text_timer = font.render(f"Timer: {int(timer)}", True, (255, 255, 255))
+    screen.blit(text_timer, (screen_width // 2 - 50, 10))
+
+
+def load_player1_animation_frames():
+    animations = {
+        'down': [pygame.transform.scale(pygame.image.load(f'assets/caco-walking-down-animation/caco-walking-down-frame-{i}.png').convert_alpha(), scaled((65, 80))) for i in range(1, 9)],
+        'up': [pygame.transform.scale(pygame.image.load(f'assets/caco-walking-up-animation/caco-walking-up-frame-{i}.png').convert_alpha(), scaled((65, 80))) for i in range(1, 9)],
+        'left': [pygame.transform.scale(pygame.image.load(f'assets/caco-walking-left-animation/caco-walking-left-frame-{i}.png').convert_alpha(), scaled((65, 80))) for i in range(1, 9)],
+        'right': [pygame.transform.scale(pygame.image.load(f'assets/caco-walking-right-animation/caco-walking-right-frame-{i}.png').convert_alpha(), scaled((65, 80))) for i in range(1, 9)],
+    }
+    return animations
+
+
+def load_player2_animation_frames():
+    animations = {
+        'down': [pygame.transform.scale(pygame.image.load(f'assets/cobra-walking-right-animation/cobra-right-{i}.png').convert_alpha(), scaled((75, 80))) for i in range(1, 9)],
+        'up': [pygame.transform.scale(pygame.image.load(f'assets/cobra-walking-left-animation/cobra-left-{i}.png').convert_alpha(), scaled((75, 80))) for i in range(1, 9)],
+        'left': [pygame.transform.scale(pygame.image.load(f'assets/cobra-walking-left-animation/cobra-left-{i}.png').convert_alpha(), scaled((75, 80))) for i in range(1, 9)],
+        'right': [pygame.transform.scale(pygame.image.load(f'assets/cobra-walking-right-animation/cobra-right-{i}.png').convert_alpha(), scaled((75, 80))) for i in range(1, 9)],
+    }
+    return animations
@@ -1,113 +1,404 @@
 import asyncio
 import websockets
 import json
+import secrets
+import struct
+import statistics
 import time
+from collections import deque
+from http import HTTPStatus
+from urllib.parse import urlsplit, parse_qs
 
-from game import Player, bombs, explosions, players, lives, reset_game, map
-from settings import SERVER_URL, SERVER_PORT
+from game import (bombs, explosions, players, lives, reset_game, map,
+                  add_player, remove_player, free_player_slot, update, snapshot, snapshot_mismatch,
+                  restore)
+from protocol import CONTROLLERS, PLACE_BOMB, unpack_input, keys_from_controller, is_newer, decode_message
+from settings import (SERVER_URL, SERVER_PORT, MIN_PLAYERS, SPECTATOR_DELAY, REATTACH_GRACE, INPUT_TIMEOUT,
+                      KEYFRAME_INTERVAL, KEEPALIVE_INTERVAL, INTEREST_CHUNK_SIZE, INTEREST_VIEW_RADIUS,
+                      CHECKPOINT_PATH, CHECKPOINT_INTERVAL, CHECKPOINT_MAX_AGE,
+                      CHECKPOINT_MAX_BYTES, CHECKPOINT_CAPTURE_BUDGET_MS)
+from spectator import SpectatorHub, StallGuard
+from checkpoint import CheckpointWriter, load_latest
+from interest import InterestGrid
+from timesync import RttProbe
 
 # Keep track of connected clients and assign player IDs
 connected_clients = {}
+spectators = SpectatorHub(SPECTATOR_DELAY)
+player_links = StallGuard()  # Players whose write buffer is full are skipped until it drains
+checkpoints = CheckpointWriter(CHECKPOINT_PATH, CHECKPOINT_INTERVAL, CHECKPOINT_MAX_BYTES,
+                               CHECKPOINT_CAPTURE_BUDGET_MS)
+# Last known key state per player, applied every tick (clients only send changes)
+input_keys = {}  # player_id -> key bitmask
+input_seq = {}  # player_id -> sequence number of the last accepted packet
+input_seen = {}  # player_id -> time the last packet arrived
+detached_players = {}  # player_id -> time it lost its connection (restored players start detached)
+tick_times = deque(maxlen=60 * 60)  # ms spent on each of the last ~60 s of ticks
+rtt_probe = RttProbe()  # End-to-end RTT of every player connection
+next_ping_at = 0
+sessions = {}  # session token -> player_id, lets a client reattach to its slot after a disconnect
+needs_keyframe = set()  # player_ids whose next snapshot resends every chunk in view
+# Players only get the part of the room around them, spectators get all of it
+interest = InterestGrid(INTEREST_CHUNK_SIZE, INTEREST_VIEW_RADIUS)
+known_chunks = {}  # player_id -> {chunk: version} of the map chunks the client has
+watching_players = set()  # Eliminated player_ids following the whole room (keyframes and deltas) instead of a view
+tick = 0
+map_revision = None  # map.revision the last keyframe was built from
+next_keyframe_at = 0
 game_is_running = False
 start_time = 0
 timestamp = 0
 
-# Serialize the game state
-def serialize_game_state():
-    state = {
-        'players': {p.player_id: [p.x,p.y] for p in players},
+# Serialize the entities, sent in full with every keyframe and delta
+def serialize_entities():
+    return {
+        'players': {p.player_id: [p.x,p.y] for p in players.values() if p.is_alive()},
         'bombs': [
-            {'x': b.x, 'y': b.y, 'player_id': b.player_id}
+            {'x': b.x, 'y': b.y, 'player_id': b.player_id, 'placed_at': b.placed_at}
             for b in bombs
         ],
         'explosions': [
-            {'sectors': e.sectors, 'bomb_type': e.bomb_type}
+            {'sectors': e.sectors, 'bomb_type': e.bomb_type, 'player_id': e.player_id}
             for e in explosions
         ],
-        'map': map.matrix,
         'lives': lives,
-        'timestamp': timestamp
+        'timestamp': timestamp,
+        'server_time': time.time()  # Same clock as placed_at and the pongs
     }
-    return state
 
-# Process inputs received from clients
-def process_input(player_id, input_data):
-    controller = input_data.get('controller', {})
-    player = next((p for p in players if p.player_id == player_id), None)
-    if not player:
+# Serialize the whole game state
+def serialize_game_state(entities=None):
+    return {'type': 'keyframe', 'tick': tick, 'map': map.matrix, **(entities or serialize_entities())}
+
+# Serialize the entities and the map cells changed since the previous tick
+def serialize_delta(cells, entities=None):
+    return {'type': 'delta', 'tick': tick, 'base': tick - 1, 'cells': cells, **(entities or serialize_entities())}
+
+# Store an input packet received from a client
+def receive_input(player_id, message):
+    if isinstance(message, bytes):
+        try:
+            seq, keys = unpack_input(message)
+        except struct.error:
+            return  # Malformed packet
+        if player_id in input_seq and not is_newer(seq, input_seq[player_id]):
+            return  # Duplicate or out of order
+        input_seq[player_id] = seq
+    else:
+        # Legacy JSON controller message (already decoded)
+        controller = message.get('controller', {})
+        if not isinstance(controller, dict):
+            return
+        keys = keys_from_controller(controller)
+    input_keys[player_id] = keys
+    input_seen[player_id] = time.time()
+
+# Answer a clock sync ping right away, on the same clock as server_time
+async def answer_ping(websocket, ping, received_at):
+    await websocket.send(json.dumps({'type': 'pong', 't0': ping.get('t0'), 't1': received_at, 't2': time.time()}))
+
+def clear_input(player_id):
+    input_keys.pop(player_id, None)
+    input_seq.pop(player_id, None)
+    input_seen.pop(player_id, None)
+
+# Process the key state of a player for one tick
+def process_input(player_id, keys):
+    player = players.get(player_id)
+    if not player or not player.is_alive():
         return
 
     # Update player's movement
-    player.move(controller)
+    player.move(CONTROLLERS[keys])
 
     # Handle bomb placement
-    if controller.get('place_bomb'):
+    if keys & PLACE_BOMB:
         player.place_bomb()
 
+def apply_inputs():
+    now = time.time()
+    for player_id, keys in input_keys.items():
+        if keys and now - input_seen[player_id] > INPUT_TIMEOUT:
+            # No packet (not even a keepalive) for too long, release the keys
+            input_keys[player_id] = keys = 0
+        if keys:
+            process_input(player_id, keys)
+
 async def handle_client(websocket):
-    player_id = len(players)
-    if player_id > 1:
-        # Only two players are allowed
-        await websocket.send(json.dumps({'error': 'Server full'}))
-        await websocket.close()
+    url = urlsplit(websocket.request.path)
+    if url.path == '/spectate':
+        await spectators.serve(websocket)
         return
 
-    # Add player to the game
-    if player_id == 0:
-        players.append(Player(1, 1, "BOMB_TYPE_1", player_id))
+    token = parse_qs(url.query).get('session', [None])[0]
+    player_id = sessions.get(token)
+    if player_id is not None and player_id in players:
+        # Same client coming back (or a restored checkpoint): keep its slot and the round going
+        detached_players.pop(player_id, None)
+        print(f"Player {player_id + 1} reattached")
     else:
-        players.append(Player(map.width - 2, map.height - 2, "BOMB_TYPE_2", player_id))
+        player_id = free_player_slot()
+        if player_id is None:
+            # Every player slot is taken, tell the client and let it watch the match instead
+            try:
+                await websocket.send(json.dumps({'type': 'spectating'}))
+            except websockets.exceptions.ConnectionClosed:
+                return
+            await spectators.serve(websocket)
+            return
 
+        # Add player to the game
+        add_player(player_id)
+        token = secrets.token_urlsafe(16)
+        sessions[token] = player_id
+
+    previous = connected_clients.get(player_id)
     connected_clients[player_id] = websocket
+    needs_keyframe.add(player_id)
+    clear_input(player_id)  # A new connection starts a new input sequence
 
     try:
+        await websocket.send(json.dumps({'type': 'welcome', 'player_id': player_id, 'session': token}))
+        if previous is not None:
+            await previous.close()  # Reconnected before the old connection timed out
         while True:
-            # Receive input from client
+            # Receive input from client, it is applied by the game loop
             message = await websocket.recv()
-            input_data = json.loads(message)
-
-            # Process input
-            process_input(player_id, input_data)
+            if isinstance(message, str):
+                received_at = time.time()
+                message = decode_message(message)
+                if message is None:
+                    continue  # Not JSON, or valid JSON but not a message
+                if message.get('type') == 'ping':
+                    await answer_ping(websocket, message, received_at)
+                    continue
+                if message.get('type') == 'pong':
+                    rtt_probe.on_pong(websocket, message)
+                    continue
+            receive_input(player_id, message)
 
     except websockets.exceptions.ConnectionClosed:
-        print(f"Player {player_id + 1} disconnected")
-        # Remove player from game
-        players[:] = [p for p in players if p.player_id != player_id]
-        lives[player_id] = 0
-        del connected_clients[player_id]
+        pass
+    finally:
+        # Whatever ended the connection, keep the player in the game for the grace window,
+        # unless it was replaced by a newer connection of the same client
+        player_links.forget(websocket)
+        rtt_probe.forget(websocket)
+        if connected_clients.get(player_id) is websocket:
+            print(f"Player {player_id + 1} disconnected, waiting {REATTACH_GRACE}s for it to come back")
+            del connected_clients[player_id]
+            needs_keyframe.discard(player_id)
+            known_chunks.pop(player_id, None)
+            watching_players.discard(player_id)
+            clear_input(player_id)
+            detached_players[player_id] = time.time()
+
+def capture_checkpoint():
+    return {
+        'saved_at': time.time(),
+        'timestamp': timestamp,
+        'running': game_is_running,
+        'sessions': dict(sessions),
+        'room': snapshot()
+    }
+
+def restore_checkpoint():
+    # Restore the room from the last checkpoint if the previous process died recently
+    global start_time, game_is_running, timestamp
+    record = load_latest(CHECKPOINT_PATH)
+    if record is None or time.time() - record['saved_at'] > CHECKPOINT_MAX_AGE:
+        return False
+    mismatch = snapshot_mismatch(record['room'])
+    if mismatch:
+        print(f"Ignoring checkpoint: {mismatch}")
+        return False
+    restore(record['room'])
+    timestamp = record['timestamp']
+    start_time = time.time() - timestamp
+    game_is_running = record['running']
+    sessions.update(record.get('sessions', {}))
+    now = time.time()
+    for player_id in players:
+        detached_players[player_id] = now
+    print(f"Restored room from checkpoint ({len(players)} players, timer {int(timestamp)})")
+    return True
+
+def drop_detached_players():
+    # Give up on players that did not come back within the grace window
+    now = time.time()
+    for player_id, since in list(detached_players.items()):
+        if now - since > REATTACH_GRACE:
+            print(f"Player {player_id + 1} did not reattach")
+            del detached_players[player_id]
+            remove_player(player_id)
+            known_chunks.pop(player_id, None)
+            watching_players.discard(player_id)
+            for token in [token for token, owner in sessions.items() if owner == player_id]:
+                del sessions[token]
+
+def next_tick():
+    # Advance the tick counter. Returns True when this tick resends full state: the map
+    # was replaced or the keyframe interval elapsed.
+    global tick, map_revision, next_keyframe_at
+    tick += 1
+    now = time.time()
+    if map.revision != map_revision or now >= next_keyframe_at:
+        map_revision = map.revision
+        next_keyframe_at = now + KEYFRAME_INTERVAL
+        return True
+    return False
+
+def publish_spectators(cells, entities, refresh):
+    # Encode this tick once for the spectators: a delta normally, a keyframe on refresh or
+    # when a spectator joins an idle hub. Nothing is encoded while nobody is watching.
+    if not spectators.listening():
+        return
+    if refresh or spectators.needs_keyframe():
+        spectators.publish(json.dumps(serialize_game_state(entities)))
+    else:
+        spectators.publish(json.dumps(serialize_delta(cells, entities)))
+
+def send_views(cells, entities, refresh):
+    # Each player gets the chunks around it, built from the shared partition of this tick.
+    # On refresh (keyframe time) the chunk cells in view are sent again. Eliminated players
+    # have no spot to follow and watch the whole room, like the spectators but undelayed.
+    interest.update(map, cells)
+    interest.begin_tick({
+        'tick': tick,
+        'revision': map.revision,
+        'width': map.width,
+        'height': map.height,
+        'far_players': {player_id: [round(x), round(y)] for player_id, (x, y) in entities['players'].items()},
+        'lives': entities['lives'],
+        'timestamp': entities['timestamp'],
+        'server_time': entities['server_time']
+    }, entities)
+    full_state = {}  # 'keyframe'/'delta' -> this tick's UTF-8 message for eliminated players, encoded once
+    now = time.monotonic()
+    for player_id, client in connected_clients.items():
+        player = players.get(player_id)
+        if player is None:
+            continue
+        known = known_chunks.setdefault(player_id, {})
+        if refresh or player_id in needs_keyframe:
+            known.clear()
+            watching_players.discard(player_id)
+        if player_links.check(client, now) == 'skip':
+            # Its known chunks are left as they are, what it misses is sent once it drains;
+            # a watching player has missed a delta and starts over from a keyframe
+            watching_players.discard(player_id)
+            continue
+        if player.is_alive():
+            if player_id in watching_players:
+                # Back in the game (new round): the view starts from scratch
+                watching_players.discard(player_id)
+                known.clear()
+            # Already UTF-8: players with the same view share one encoding
+            websockets.broadcast((client,), interest.snapshot(player.x, player.y, known), text=True)
+            continue
+        kind = 'delta' if player_id in watching_players else 'keyframe'
+        if kind not in full_state:
+            message = serialize_delta(cells, entities) if kind == 'delta' else serialize_game_state(entities)
+            full_state[kind] = json.dumps(message).encode()
+        websockets.broadcast((client,), full_state[kind], text=True)
+        watching_players.add(player_id)
+    needs_keyframe.clear()
+
+def ping_players():
+    # RTT pings every KEEPALIVE_INTERVAL s; the clients echo them, so they time the whole
+    # path, through whatever proxy is on the way (spectators are pinged by their hub)
+    global next_ping_at
+    now = time.monotonic()
+    if now >= next_ping_at and connected_clients:
+        next_ping_at = now + KEEPALIVE_INTERVAL
+        clients = list(connected_clients.values())
+        websockets.broadcast(clients, rtt_probe.ping(clients))
+
+def rtt_ms(probe, websocket):
+    rtt = probe.rtt(websocket)
+    return round(rtt * 1000, 1) if rtt is not None else None
+
+def server_stats():
+    # Network latency next to the time the server spends on a tick. RTTs are measured by the
+    # server itself, end to end (see ping_players), None until the first answer
+    spectator_rtts = [rtt_ms(spectators.probe, websocket) for websocket in spectators.spectators]
+    spectator_rtts = [rtt for rtt in spectator_rtts if rtt is not None]
+    return {
+        'players': {
+            player_id: {'rtt_ms': rtt_ms(rtt_probe, websocket)}
+            for player_id, websocket in sorted(connected_clients.items())
+        },
+        'detached_players': sorted(detached_players),
+        'spectators': {
+            'count': len(spectators.spectators),
+            'rtt_ms_median': round(statistics.median(spectator_rtts), 1) if spectator_rtts else None,
+        },
+        'tick_ms': {
+            'avg': round(sum(tick_times) / len(tick_times), 3) if tick_times else 0.0,
+            'max': round(max(tick_times, default=0.0), 3),
+        },
+        'checkpoints': checkpoints.stats(),
+    }
+
+def latency_stats():
+    stats = server_stats()
+    rtt = ' '.join(
+        f"P{player_id + 1}={player['rtt_ms']:.0f}ms" if player['rtt_ms'] is not None else f"P{player_id + 1}=-"
+        for player_id, player in stats['players'].items()
+    )
+    return f"rtt {rtt or '-'} tick avg={stats['tick_ms']['avg']:.3f}ms max={stats['tick_ms']['max']:.3f}ms"
+
+def process_request(connection, request):
+    # Plain HTTP GET /stats answers with server_stats() as JSON, for scraping
+    if urlsplit(request.path).path == '/stats':
+        return connection.respond(HTTPStatus.OK, json.dumps(server_stats()) + '\n')
+    return None
 
 async def game_loop():
     global start_time, game_is_running, timestamp
+    next_stats_at = time.time() + 60
     while True:
-        if len(players) == 2 and not game_is_running:
+        tick_start = time.perf_counter()
+        if len(players) >= MIN_PLAYERS and not game_is_running:
             start_time = time.time()
             game_is_running = True
-        if game_is_running and len(players) == 2:
+        if game_is_running and len(players) >= MIN_PLAYERS:
             timestamp = time.time() - start_time
         else:
             game_is_running = False
 
-        # Update bombs and explosions
-        for bomb in bombs:
-            bomb.update()
-        for explosion in explosions:
-            explosion.update()
+        # Apply the last known input of every player, then update bombs and explosions
+        apply_inputs()
+        update()
+        if detached_players:
+            drop_detached_players()
+
+        # Checkpoint the room (capture only, the writer thread does the encoding and the disk)
+        checkpoints.maybe_checkpoint(capture_checkpoint)
+        if time.time() >= next_stats_at:
+            next_stats_at = time.time() + 60
+            print(checkpoints.summary())
+            print(latency_stats())
 
-        # Send game state to all connected clients
-        state = serialize_game_state()
-        message = json.dumps(state)
-        await asyncio.gather(*(client.send(message) for client in connected_clients.values()))
+        # Send game state: the whole room to the spectators, the area around each player to it
+        cells = map.take_changes()
+        entities = serialize_entities()
+        refresh = next_tick()
+        publish_spectators(cells, entities, refresh)  # Same encoded message, shared with every spectator
+        send_views(cells, entities, refresh)
+        ping_players()
+        tick_times.append((time.perf_counter() - tick_start) * 1000)
 
         await asyncio.sleep(1 / 60)  # Run at ~60 FPS
 
-def main():
-    reset_game()
-    start_server = websockets.serve(handle_client, '0.0.0.0', SERVER_PORT)
-    loop = asyncio.get_event_loop()
-    loop.run_until_complete(start_server)
-    loop.create_task(game_loop())
-    print(f"Server started on ws://{SERVER_URL}:{SERVER_PORT}")
-    loop.run_forever()
+async def main():
+    map.track_changes = True  # The game loop takes them every tick for deltas and views
+    if not restore_checkpoint():
+        reset_game()
+    async with websockets.serve(handle_client, '0.0.0.0', SERVER_PORT, process_request=process_request,
+                                ping_interval=KEEPALIVE_INTERVAL):
+        print(f"Server started on ws://{SERVER_URL}:{SERVER_PORT}")
+        await game_loop()
 
 if __name__ == "__main__":
-    main()
+    asyncio.run(main())
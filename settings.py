@@ -1,13 +1,47 @@
-import tomli
+try:
+    import tomllib  # Python 3.11+, no third-party import on the server path
+except ModuleNotFoundError:
+    import tomli as tomllib
 
 # Load the TOML file
 with open('settings.toml', 'rb') as f:
-    data = tomli.load(f)
+    data = tomllib.load(f)
 
 # Load server settings
 server = data['server']
 SERVER_URL = server['url']
 SERVER_PORT = server['port']
+REATTACH_GRACE = server['reattach_grace']
+INPUT_TIMEOUT = server['input_timeout']
+KEYFRAME_INTERVAL = server['keyframe_interval']
+KEEPALIVE_INTERVAL = server['keepalive_interval']  # Websocket pings, also how often the server measures RTT
+
+# Load area of interest settings (chunks of chunk_size cells, players see view_radius chunks around them)
+interest = data['interest']
+INTEREST_CHUNK_SIZE = interest['chunk_size']
+INTEREST_VIEW_RADIUS = interest['view_radius']
+
+# Load client settings
+client = data['client']
+RECONNECT_TIMEOUT = client['reconnect_timeout']
+INPUT_KEEPALIVE = client['input_keepalive']
+PING_INTERVAL = client['ping_interval']
+CLOCK_SAMPLES = client['clock_samples']
+
+# Load checkpoint settings
+checkpoint = data['checkpoint']
+CHECKPOINT_PATH = checkpoint['path']
+CHECKPOINT_INTERVAL = checkpoint['interval']
+CHECKPOINT_MAX_AGE = checkpoint['max_age']
+CHECKPOINT_MAX_BYTES = checkpoint['max_bytes']
+CHECKPOINT_CAPTURE_BUDGET_MS = checkpoint['capture_budget_ms']
+
+# Load spectator settings
+spectator = data['spectator']
+SPECTATOR_DELAY = spectator['delay']
+SPECTATOR_PORT = spectator['port']
+SPECTATOR_HIGH_WATER = spectator['high_water_bytes']  # Per connection, see spectator.StallGuard
+SPECTATOR_STALL_TIMEOUT = spectator['stall_timeout']
 
 # Load game settings
 game = data['game']
@@ -22,25 +56,20 @@ TOLERANCE = game['tolerance']
 PLAYER_LIVES = game['player_lives']
 EXPLOSION_DURATION = game['explosion_duration']
 BOMB_EXPLOSION_RANGE = game['bomb_explosion_range']
+MAX_PLAYERS = game['max_players']
+MIN_PLAYERS = game['min_players']
+BREAKABLE_DENSITY = game['breakable_density']
 
-# Load colors
-colors = data['colors']
-BACKGROUND_COLOR = tuple(colors['background_color'])
-GRID_COLOR = tuple(colors['grid_color'])
-BREAKABLE_COLOR = tuple(colors['breakable_color'])
-BREAKING_COLOR = tuple(colors['breaking_color'])
-BOMB_COLOR = tuple(colors['bomb_color'])
-OBSTACLE_COLOR = tuple(colors['obstacle_color'])
-PLAYER_COLOR = tuple(colors['player_color'])
-PLAYER_2_COLOR = tuple(colors['player_2_color'])
-HUD_COLOR = tuple(colors['hud_color'])
-PLAYER1_EXPLOSION_COLOR = tuple(colors['player1_explosion_color'])
-PLAYER2_EXPLOSION_COLOR = tuple(colors['player2_explosion_color'])
+# Colors are client-only, they are built by render.py from data['colors']
 
 # __all__ to help LSP tools recognize exported variables
 __all__ = [
     'TILE_SIZE', 'GRID_WIDTH', 'GRID_HEIGHT', 'HUD_HEIGHT', 'SCREEN_WIDTH', 'SCREEN_HEIGHT',
-    'PRECISION', 'TOLERANCE', 'BACKGROUND_COLOR', 'GRID_COLOR', 'BREAKABLE_COLOR',
-    'BREAKING_COLOR', 'BOMB_COLOR', 'OBSTACLE_COLOR', 'PLAYER_COLOR', 'PLAYER_2_COLOR',
-    'HUD_COLOR', 'PLAYER_LIVES', 'EXPLOSION_DURATION', 'BOMB_EXPLOSION_RANGE', 'PLAYER1_EXPLOSION_COLOR', 'PLAYER2_EXPLOSION_COLOR', 'SERVER_URL', 'SERVER_PORT'
+    'PRECISION', 'TOLERANCE', 'PLAYER_LIVES', 'EXPLOSION_DURATION', 'BOMB_EXPLOSION_RANGE',
+    'SERVER_URL', 'SERVER_PORT', 'SPECTATOR_DELAY', 'SPECTATOR_PORT', 'SPECTATOR_HIGH_WATER', 'SPECTATOR_STALL_TIMEOUT', 'RECONNECT_TIMEOUT', 'REATTACH_GRACE',
+    'INPUT_TIMEOUT', 'INPUT_KEEPALIVE', 'KEYFRAME_INTERVAL', 'KEEPALIVE_INTERVAL', 'PING_INTERVAL', 'CLOCK_SAMPLES',
+    'INTEREST_CHUNK_SIZE', 'INTEREST_VIEW_RADIUS',
+    'CHECKPOINT_PATH', 'CHECKPOINT_INTERVAL', 'CHECKPOINT_MAX_AGE', 'CHECKPOINT_MAX_BYTES',
+    'CHECKPOINT_CAPTURE_BUDGET_MS',
+    'MAX_PLAYERS', 'MIN_PLAYERS', 'BREAKABLE_DENSITY'
 ]
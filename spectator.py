@@ -0,0 +1,166 @@
+import argparse
+import asyncio
+import time
+from collections import deque
+
+import websockets
+
+from protocol import is_keyframe, is_ping, decode_message
+from settings import (SERVER_URL, SERVER_PORT, SPECTATOR_DELAY, SPECTATOR_PORT, SPECTATOR_HIGH_WATER,
+                      SPECTATOR_STALL_TIMEOUT, KEEPALIVE_INTERVAL)
+from timesync import RttProbe, pong
+
+# Spectator fan-out. The game loop encodes each snapshot once and hands the
+# same message object to publish(); it is sent as-is to every spectator with
+# websockets.broadcast, which never waits on a slow viewer. In relay mode a
+# separate process watches the game server as a single spectator and fans the
+# match out to its own viewers, so the game process only pays for one socket.
+# A viewer joining mid-match first gets the last keyframe and the deltas
+# published after it, then follows the live stream.
+#
+# broadcast has no backpressure, so a viewer whose write buffer is over the
+# high-water mark is skipped instead of buffering every tick for it. Once it
+# drains it is resynced from the last keyframe; if it stays stuck it is dropped.
+#
+# With nobody watching the game loop does not encode anything for the hub
+# (see listening()); the first message after that must be a keyframe
+# (needs_keyframe()), which a delayed stream then holds back like the rest.
+#
+# Every ping_interval the viewers get an RTT ping (timesync.RttProbe), live even
+# when the stream is delayed. A relay answers the pings of its upstream itself
+# instead of passing them on, so each hop measures its own viewers.
+#
+#   python3 spectator.py                                  # relay the local game server
+#   python3 spectator.py --upstream ws://host:8765/spectate --port 8766 --delay 30
+
+
+class StallGuard:
+    # Tracks connections whose write buffer is over high_water bytes
+    def __init__(self, high_water=SPECTATOR_HIGH_WATER, stall_timeout=SPECTATOR_STALL_TIMEOUT):
+        self.high_water = high_water
+        self.stall_timeout = stall_timeout
+        self.stalled = {}  # websocket -> when it went over the high-water mark
+
+    def check(self, websocket, now):
+        # 'send', 'skip' (still draining, or just dropped) or 'resume' (drained after a stall)
+        transport = getattr(websocket, 'transport', None)
+        if transport is not None and transport.get_write_buffer_size() > self.high_water:
+            since = self.stalled.setdefault(websocket, now)
+            if now - since > self.stall_timeout:
+                transport.abort()  # Stuck for good, free its buffer now
+                del self.stalled[websocket]
+            return 'skip'
+        if websocket in self.stalled:
+            del self.stalled[websocket]
+            return 'resume'
+        return 'send'
+
+    def forget(self, websocket):
+        self.stalled.pop(websocket, None)
+
+
+class SpectatorHub:
+    def __init__(self, delay=0, guard=None, ping_interval=KEEPALIVE_INTERVAL):
+        self.delay = delay  # Seconds the spectators lag behind the live match
+        self.guard = guard or StallGuard()
+        self.probe = RttProbe()
+        self.ping_interval = ping_interval
+        self.next_ping_at = 0
+        self.spectators = set()
+        self.buffer = deque()  # (received_at, message) waiting for the delay to pass
+        self.catch_up = []  # Last released keyframe and every delta released since
+
+    def listening(self):
+        return bool(self.spectators)
+
+    def needs_keyframe(self):
+        # Nothing buffered or released since the hub went idle: the next message must be a keyframe
+        return not self.catch_up and not self.buffer
+
+    def publish(self, message):
+        now = time.monotonic()
+        if now >= self.next_ping_at and self.spectators:
+            self.next_ping_at = now + self.ping_interval
+            viewers = [websocket for websocket in self.spectators if websocket not in self.guard.stalled]
+            websockets.broadcast(viewers, self.probe.ping(viewers))
+        if not self.delay:
+            self._release(message)
+            return
+        self.buffer.append((now, message))
+        # Release everything that is older than the delay
+        release_before = now - self.delay
+        while self.buffer and self.buffer[0][0] <= release_before:
+            _, delayed = self.buffer.popleft()
+            self._release(delayed)
+
+    def _release(self, message):
+        if is_keyframe(message):
+            self.catch_up = [message]
+        elif self.catch_up:
+            self.catch_up.append(message)
+        now = time.monotonic()
+        ready = []
+        for websocket in self.spectators:
+            status = self.guard.check(websocket, now)
+            if status == 'send':
+                ready.append(websocket)
+            elif status == 'resume':
+                # Missed messages while stalled: start over from the keyframe (this message included)
+                for caught_up in self.catch_up or (message,):
+                    websockets.broadcast((websocket,), caught_up)
+        websockets.broadcast(ready, message)
+
+    async def serve(self, websocket):
+        # Queued without awaiting, so nothing is published between the catch-up and the live stream
+        for message in self.catch_up:
+            websockets.broadcast((websocket,), message)
+        self.spectators.add(websocket)
+        try:
+            # Spectators only answer RTT pings, drain whatever else they send until they leave
+            async for message in websocket:
+                message = decode_message(message) if isinstance(message, str) else None
+                if message is not None and message.get('type') == 'pong':
+                    self.probe.on_pong(websocket, message)
+        except websockets.exceptions.ConnectionClosed:
+            pass
+        finally:
+            self.spectators.discard(websocket)
+            self.guard.forget(websocket)
+            self.probe.forget(websocket)
+            if not self.spectators:
+                # Idle: the game loop stops publishing, start over from a keyframe
+                self.buffer.clear()
+                self.catch_up = []
+
+
+async def relay(hub, upstream):
+    # Watch the game server as one spectator and republish every message untouched
+    while True:
+        try:
+            async with websockets.connect(upstream) as websocket:
+                print(f"Relaying {upstream}")
+                async for message in websocket:
+                    if is_ping(message):
+                        await websocket.send(pong(decode_message(message)))
+                        continue
+                    hub.publish(message)
+        except (OSError, websockets.exceptions.WebSocketException) as e:
+            print(f"Upstream unavailable ({e}), retrying")
+        await asyncio.sleep(1)
+
+
+async def main():
+    parser = argparse.ArgumentParser(description='Overblocked spectator relay')
+    parser.add_argument('--upstream', default=f"ws://{SERVER_URL}:{SERVER_PORT}/spectate")
+    parser.add_argument('--port', type=int, default=SPECTATOR_PORT)
+    parser.add_argument('--delay', type=float, default=SPECTATOR_DELAY)
+    args = parser.parse_args()
+
+    hub = SpectatorHub(args.delay)
+    async with websockets.serve(hub.serve, '0.0.0.0', args.port):
+        print(f"Spectator relay started on ws://0.0.0.0:{args.port}")
+        await relay(hub, args.upstream)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,100 @@
+import json
+import statistics
+import time
+from collections import deque
+
+# Client-side estimate of the server clock and the round-trip time.
+#
+# The client sends {"type": "ping", "t0"} and the server answers right away
+# with {"type": "pong", "t0", "t1", "t2"}: t1 when the ping arrived and t2
+# when the pong left, both on the server clock. With t3 the arrival of the
+# pong on the client clock, NTP style:
+#
+#   rtt    = (t3 - t0) - (t2 - t1)
+#   offset = ((t1 - t0) + (t2 - t3)) / 2
+#
+# The last few samples are kept; the offset comes from the sample with the
+# lowest RTT (the least queueing, so the least skewed), the RTT is their median.
+# Until the first pong (or when nobody answers pings, e.g. a spectator relay)
+# the offset is taken from the snapshots themselves, which is late by the
+# one-way delay but steady, enough for animations (and for a delayed
+# spectator stream it is exactly what we want).
+#
+# The other way round, the server measures each connection's RTT itself with
+# RttProbe: every few seconds it sends {"type": "ping", "seq"} as a regular
+# message and the client (or a relay) echoes {"type": "pong", "seq"}. Unlike
+# websocket keepalive pings, which the first proxy or relay on the way answers
+# itself, these cross every hop to the other end and back.
+
+
+class ClockSync:
+    def __init__(self, samples=8):
+        self.samples = deque(maxlen=samples)  # (rtt, offset)
+        self.offset = None  # server clock - local clock, in seconds
+        self.rtt = None  # Seconds
+
+    def ping(self):
+        return json.dumps({'type': 'ping', 't0': time.monotonic()})
+
+    def on_pong(self, message, received_at=None):
+        t3 = time.monotonic() if received_at is None else received_at
+        t0, t1, t2 = message['t0'], message['t1'], message['t2']
+        rtt = max((t3 - t0) - (t2 - t1), 0.0)
+        self.samples.append((rtt, ((t1 - t0) + (t2 - t3)) / 2))
+        self.offset = min(self.samples)[1]
+        self.rtt = statistics.median(sample[0] for sample in self.samples)
+
+    def on_snapshot(self, server_time, received_at=None):
+        # Fallback offset while there are no pong samples, from the least delayed snapshot so far
+        if not self.samples:
+            offset = server_time - (time.monotonic() if received_at is None else received_at)
+            if self.offset is None or offset > self.offset:
+                self.offset = offset
+
+    @property
+    def synced(self):
+        return bool(self.samples)
+
+    def server_now(self):
+        # Current time on the server clock, None until something was received
+        if self.offset is None:
+            return None
+        return time.monotonic() + self.offset
+
+
+def pong(ping):
+    # Echo of a server RTT ping
+    return json.dumps({'type': 'pong', 'seq': ping.get('seq')})
+
+
+class RttProbe:
+    def __init__(self, samples=8):
+        self.samples = samples
+        self.seq = 0
+        self.sent = {}  # websocket -> (seq, sent_at) of the ping waiting for its pong
+        self.rtts = {}  # websocket -> last samples, in seconds
+
+    def ping(self, connections):
+        # Message to broadcast to these connections, each one now waits for its echo
+        self.seq += 1
+        now = time.monotonic()
+        for websocket in connections:
+            self.sent[websocket] = (self.seq, now)
+        return json.dumps({'type': 'ping', 'seq': self.seq})
+
+    def on_pong(self, websocket, message, received_at=None):
+        sent = self.sent.get(websocket)
+        if sent is None or message.get('seq') != sent[0]:
+            return  # Not asked for, or the answer to a ping that was superseded
+        del self.sent[websocket]
+        rtt = (time.monotonic() if received_at is None else received_at) - sent[1]
+        self.rtts.setdefault(websocket, deque(maxlen=self.samples)).append(rtt)
+
+    def rtt(self, websocket):
+        # Median of the last samples in seconds, None until the first pong
+        samples = self.rtts.get(websocket)
+        return statistics.median(samples) if samples else None
+
+    def forget(self, websocket):
+        self.sent.pop(websocket, None)
+        self.rtts.pop(websocket, None)